@@ -5,87 +5,221 @@ Strips comments, docstrings, and unnecessary whitespace from Python files
 while preserving functionality
 """
 
+import io
 import os
 import sys
 import ast
-import astor
+import errno
+import re
+import json
+import shutil
+import fnmatch
+import hashlib
+import tokenize
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Set
-
-
-class DocstringRemover(ast.NodeTransformer):
-    """AST transformer to remove docstrings while preserving code"""
-
-    def visit_Module(self, node):
-        # Remove module-level docstring
-        if (node.body and isinstance(node.body[0], ast.Expr) and
-                isinstance(node.body[0].value, (ast.Str, ast.Constant))):
-            node.body = node.body[1:]
-        self.generic_visit(node)
-        return node
-
-    def visit_FunctionDef(self, node):
-        # Remove function docstring
-        if (node.body and isinstance(node.body[0], ast.Expr) and
-                isinstance(node.body[0].value, (ast.Str, ast.Constant))):
-            node.body = node.body[1:]
-        self.generic_visit(node)
-        return node
-
-    def visit_AsyncFunctionDef(self, node):
-        # Remove async function docstring
-        if (node.body and isinstance(node.body[0], ast.Expr) and
-                isinstance(node.body[0].value, (ast.Str, ast.Constant))):
-            node.body = node.body[1:]
-        self.generic_visit(node)
-        return node
-
-    def visit_ClassDef(self, node):
-        # Remove class docstring
-        if (node.body and isinstance(node.body[0], ast.Expr) and
-                isinstance(node.body[0].value, (ast.Str, ast.Constant))):
-            node.body = node.body[1:]
-        self.generic_visit(node)
-        return node
-
-
-def strip_python_file(input_path: Path, output_path: Path, preserve_signatures: bool = True) -> bool:
+from typing import Dict, List, Optional, Set, Tuple
+
+
+# Node types whose first body statement may be a docstring
+DOCSTRING_OWNERS = (ast.Module, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+# Nodes that can (transitively) contain a def/class; expression subtrees cannot
+STATEMENT_NODES = (ast.stmt, ast.excepthandler) + (
+    (ast.match_case,) if hasattr(ast, 'match_case') else ()
+)
+
+
+# Conservative check for a string literal in docstring position: at module
+# start, as the first line of an indented block, or after a one-line def/class.
+# False positives only cost an AST pass; a miss would leave a docstring behind.
+MAY_HAVE_DOCSTRING = re.compile(
+    rb'\A\s*[rRuUbB]{0,2}[\'"]'
+    rb'|:[ \t]*\r?\n\s*[rRuUbB]{0,2}[\'"]'
+    rb'|^[ \t]*(?:async[ \t]+def|def|class)\b[^\n]*:[ \t]*[rRuUbB]{0,2}[\'"]',
+    re.MULTILINE
+)
+
+
+def iter_docstrings(tree: ast.AST):
+    """
+    Yield (owner, expr) for each module, class and function docstring
+
+    Walks the tree with an explicit stack instead of recursive visitor calls,
+    descending only into statements since expressions cannot hold a def or
+    class. Only string constants count as docstrings, so bodies such as
+    ``...`` are kept. Children are pushed after the owner is yielded, so the
+    caller may edit ``owner.body`` in between.
+
+    Args:
+        tree: Parsed module
+
+    Yields:
+        Tuple of (owning node, docstring ast.Expr)
+    """
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, DOCSTRING_OWNERS):
+            body = node.body
+            if (body and isinstance(body[0], ast.Expr) and
+                    isinstance(body[0].value, ast.Constant) and
+                    isinstance(body[0].value.value, str)):
+                yield node, body[0]
+        stack.extend(
+            child for child in ast.iter_child_nodes(node)
+            if isinstance(child, STATEMENT_NODES)
+        )
+
+
+def strip_docstrings(tree: ast.AST) -> ast.AST:
+    """
+    Remove module, class and function docstrings in place
+
+    Bodies left empty get a ``pass`` so the unparsed code stays valid.
+
+    Args:
+        tree: Parsed module
+
+    Returns:
+        The same tree, mutated
+    """
+    for node, _ in iter_docstrings(tree):
+        body = node.body
+        del body[0]
+        if not body and not isinstance(node, ast.Module):
+            body.append(ast.Pass())
+    return tree
+
+
+def splice_docstrings(source_bytes: bytes, tree: ast.AST) -> bytes:
+    """
+    Cut docstrings out of the original UTF-8 source instead of unparsing
+
+    Only the docstring spans are rewritten; every other byte is copied
+    verbatim, so formatting is preserved. Class and function docstrings
+    become ``pass`` (always valid, even as the only statement); a module
+    docstring is dropped unless code follows it on the same line. A
+    multi-line docstring is padded with blank lines to its original
+    height, so line numbers in tracebacks still match the source.
+
+    Args:
+        source_bytes: UTF-8 source (AST column offsets are UTF-8 byte offsets)
+        tree: ast.parse() result for source_bytes
+
+    Returns:
+        Source with docstrings removed
+    """
+    lines = source_bytes.splitlines(keepends=True)
+
+    # Apply edits bottom-up so earlier line/column positions stay valid
+    spans = sorted(iter_docstrings(tree), key=lambda d: (d[1].lineno, d[1].col_offset), reverse=True)
+    for owner, expr in spans:
+        first = lines[expr.lineno - 1]
+        tail = lines[expr.end_lineno - 1][expr.end_col_offset:]
+        replacement = b'' if isinstance(owner, ast.Module) and not tail.strip() else b'pass'
+        eol = b'\r\n' if first.endswith(b'\r\n') else b'\n'
+        padding = eol * (expr.end_lineno - expr.lineno)
+        head = first[:expr.col_offset]
+        if head.strip():
+            # Code precedes the docstring on its line (def f(): """...), so pad after it;
+            # only code after the closing quotes on that same line moves up
+            lines[expr.lineno - 1:expr.end_lineno] = [head + replacement + tail + padding]
+        else:
+            lines[expr.lineno - 1:expr.end_lineno] = [padding + head + replacement + tail]
+
+    return b''.join(lines)
+
+
+def is_utf8_source(source_bytes: bytes) -> bool:
+    """Check that source is plain UTF-8 (no BOM, no other coding cookie)"""
+    encoding, _ = tokenize.detect_encoding(io.BytesIO(source_bytes).readline)
+    return encoding == 'utf-8'
+
+
+def strip_python_file(
+    input_path: Path,
+    output_path: Path,
+    preserve_signatures: bool = True,
+    cache_dir: Optional[Path] = None,
+    stats: Optional[Dict[str, int]] = None
+) -> bool:
     """
     Strip comments and docstrings from a Python file
 
     Args:
         input_path: Source file path
-        output_path: Destination file path
+        output_path: Destination file path (its directory must already exist)
         preserve_signatures: Keep function signatures for FastAPI routing
+        cache_dir: Optional content-addressed cache of stripped output, so
+            identical sources (e.g. moved files) skip the AST pass
+        stats: Optional counter, incremented with the strategy used
+            ('passthrough', 'cache', 'splice' or 'unparse')
 
     Returns:
         True if successful, False otherwise
     """
+    def record(strategy: str) -> None:
+        if stats is not None:
+            stats[strategy] = stats.get(strategy, 0) + 1
+
     try:
-        with open(input_path, 'r', encoding='utf-8') as f:
-            source_code = f.read()
+        # Bytes go straight to ast.parse, which honours PEP 263 encoding cookies
+        source_bytes = input_path.read_bytes()
+
+        # Nothing to strip (no comments, no docstrings): skip the AST round trip
+        if b'#' not in source_bytes and not MAY_HAVE_DOCSTRING.search(source_bytes):
+            output_path.write_bytes(source_bytes)
+            record('passthrough')
+            return True
+
+        # Reuse stripped output of byte-identical sources
+        cache_file = None
+        if cache_dir is not None:
+            digest = hashlib.blake2b(source_bytes, digest_size=16,
+                                     salt=b'v%d' % STRIP_FORMAT).hexdigest()
+            cache_file = cache_dir / f"{digest}.stripped"
+            if cache_file.exists():
+                shutil.copyfile(cache_file, output_path)
+                record('cache')
+                return True
 
         # Parse the source code
-        tree = ast.parse(source_code)
-
-        # Remove docstrings
-        remover = DocstringRemover()
-        tree = remover.visit(tree)
+        tree = ast.parse(source_bytes)
 
-        # Convert back to code
-        stripped_code = astor.to_source(tree)
+        if b'#' not in source_bytes and is_utf8_source(source_bytes):
+            # No comments to drop: splice docstrings out of the original bytes
+            stripped_bytes = splice_docstrings(source_bytes, tree)
+            record('splice')
+        else:
+            # Remove docstrings
+            strip_docstrings(tree)
+
+            # Convert back to code (ast.unparse is built in since Python 3.9)
+            ast.fix_missing_locations(tree)
+            try:
+                stripped_code = ast.unparse(tree)
+            except AttributeError:
+                import astor
+                stripped_code = astor.to_source(tree)
+            stripped_bytes = stripped_code.encode('utf-8')
+            record('unparse')
 
         # Write to output file
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(stripped_code)
+        output_path.write_bytes(stripped_bytes)
+
+        # Populate the cache atomically, other workers may read it concurrently
+        if cache_file is not None:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+            shutil.copyfile(output_path, tmp_file)
+            os.replace(tmp_file, cache_file)
 
         return True
 
     except SyntaxError as e:
         print(f"  ⚠️  Syntax error in {input_path}: {e}")
         # Copy original file if parsing fails
-        import shutil
         shutil.copy2(input_path, output_path)
         return False
     except Exception as e:
@@ -93,94 +227,289 @@ def strip_python_file(input_path: Path, output_path: Path, preserve_signatures:
         return False
 
 
-def process_directory(
+# Bump when stripped output changes shape, so manifests and cached output
+# written by an older version are not reused
+STRIP_FORMAT = 2
+CACHE_MANIFEST = f'.prepare_cache.v{STRIP_FORMAT}.json'
+STRIPPED_CACHE_DIR = '.stripped_cache'
+
+
+def load_manifest(output_dir: Path) -> dict:
+    """Load the rel_path -> [mtime_ns, size] manifest from a previous run"""
+    try:
+        with open(output_dir / CACHE_MANIFEST, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(output_dir: Path, manifest: dict) -> None:
+    """Persist the manifest so the next run can skip unchanged files"""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with open(output_dir / CACHE_MANIFEST, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+
+
+def compile_excludes(exclude_patterns: Set[str]):
+    """
+    Split exclude patterns into an exact-name set and one compiled glob regex
+
+    Args:
+        exclude_patterns: Names (e.g. '__pycache__') or name globs (e.g. 'test_*.py')
+
+    Returns:
+        Predicate taking a bare file/directory name and returning True if excluded
+    """
+    exact_names = frozenset(p for p in exclude_patterns if '*' not in p and '?' not in p)
+    globs = [fnmatch.translate(p) for p in exclude_patterns if p not in exact_names]
+    glob_regex = re.compile('|'.join(globs)) if globs else None
+
+    def is_excluded(name: str) -> bool:
+        return name in exact_names or (glob_regex is not None and glob_regex.match(name) is not None)
+
+    return is_excluded
+
+
+def scan_tree(
     source_dir: Path,
-    output_dir: Path,
-    exclude_patterns: Set[str] = None
-) -> tuple:
+    exclude_patterns: Set[str],
+    copy_extensions: Set[str]
+) -> Tuple[List[tuple], List[tuple]]:
     """
-    Process all Python files in directory
+    Walk source_dir once and sort files into Python and copy-only lists
+
+    Excluded directories are pruned so the walk never descends into them.
+    Each DirEntry's cached type and stat data are reused, so no extra stat
+    calls are issued per file.
 
     Args:
-        source_dir: Source directory
+        source_dir: Directory to walk
+        exclude_patterns: Directory/file names (or name globs) to skip, matched
+            against the bare entry name
+        copy_extensions: Non-Python extensions to copy, e.g. {'.html'}
+
+    Returns:
+        Tuple of (python_files, other_files), each a list of
+        (path, rel_path, stat_result) tuples
+    """
+    is_excluded = compile_excludes(exclude_patterns)
+
+    python_files = []
+    other_files = []
+    stack = [(str(source_dir), Path())]
+
+    while stack:
+        dir_path, rel_dir = stack.pop()
+        with os.scandir(dir_path) as entries:
+            for entry in sorted(entries, key=lambda e: e.name):
+                name = entry.name
+                if is_excluded(name):
+                    continue
+
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, rel_dir / name))
+                    continue
+
+                if not entry.is_file():
+                    continue
+
+                ext = '.' + name.rpartition('.')[2]
+                if ext == '.py':
+                    python_files.append((Path(entry.path), rel_dir / name, entry.stat()))
+                elif ext in copy_extensions:
+                    other_files.append((Path(entry.path), rel_dir / name, entry.stat()))
+
+    return python_files, other_files
+
+
+def _strip_worker(args: Tuple[Path, Path, Path]) -> Tuple[bool, Dict[str, int]]:
+    """Process-pool entry point wrapping strip_python_file"""
+    input_path, output_path, cache_dir = args
+    stats: Dict[str, int] = {}
+    ok = strip_python_file(input_path, output_path, cache_dir=cache_dir, stats=stats)
+    return ok, stats
+
+
+def process_python_files(python_files: List[tuple], output_dir: Path) -> tuple:
+    """
+    Strip Python files found by scan_tree
+
+    Args:
+        python_files: List of (path, rel_path, stat_result) tuples
         output_dir: Output directory
-        exclude_patterns: Set of patterns to exclude
 
     Returns:
         Tuple of (processed_count, failed_count)
     """
-    if exclude_patterns is None:
-        exclude_patterns = {
-            '__pycache__',
-            '.git',
-            '.pytest_cache',
-            'build',
-            'dist',
-            '*.egg-info'
-        }
-
     processed = 0
     failed = 0
 
-    print(f"\n📦 Processing Python files:")
-    print(f"  Source: {source_dir}")
-    print(f"  Output: {output_dir}")
-    print()
-
-    for py_file in source_dir.rglob('*.py'):
-        # Check if file should be excluded
-        if any(pattern in str(py_file) for pattern in exclude_patterns):
-            continue
+    manifest = load_manifest(output_dir)
+    new_manifest = {}
+    skipped = 0
 
-        # Calculate relative path and output path
-        rel_path = py_file.relative_to(source_dir)
+    # Collect work first so files can be stripped in parallel
+    tasks = []
+    for py_file, rel_path, st in python_files:
         out_file = output_dir / rel_path
+        key = rel_path.as_posix()
 
-        print(f"  Processing: {rel_path}...", end='  ')
+        # Skip files unchanged since the last run
+        stamp = [st.st_mtime_ns, st.st_size]
+        if manifest.get(key) == stamp and out_file.exists():
+            new_manifest[key] = stamp
+            skipped += 1
+            continue
 
-        if strip_python_file(py_file, out_file):
-            print("✓")
+        tasks.append((py_file, out_file, key, stamp))
+
+    # AST parse/unparse is CPU-bound, so use worker processes
+    results = []
+    if tasks:
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            results = list(executor.map(
+                _strip_worker,
+                [(t[0], t[1], output_dir / STRIPPED_CACHE_DIR) for t in tasks],
+                chunksize=32
+            ))
+
+    # Report in input order once all workers are done, in a single write
+    lines = []
+    strategy_counts: Dict[str, int] = {}
+    for (py_file, out_file, key, stamp), (ok, stats) in zip(tasks, results):
+        for strategy, count in stats.items():
+            strategy_counts[strategy] = strategy_counts.get(strategy, 0) + count
+        rel_path = out_file.relative_to(output_dir)
+        if ok:
+            lines.append(f"  Processing: {rel_path}...  ✓\n")
+            new_manifest[key] = stamp
             processed += 1
         else:
-            print("⚠️  (copied original)")
+            lines.append(f"  Processing: {rel_path}...  ⚠️  (copied original)\n")
             failed += 1
+    sys.stdout.write(''.join(lines))
+
+    if skipped:
+        print(f"  Unchanged (skipped): {skipped}")
+    if strategy_counts:
+        # Makes fast-path hit rates (and regressions) visible per run
+        summary = ', '.join(f"{k}={v}" for k, v in sorted(strategy_counts.items()))
+        print(f"  Strategies: {summary}")
+
+    save_manifest(output_dir, new_manifest)
 
     return processed, failed
 
 
-def copy_non_python_files(source_dir: Path, output_dir: Path, extensions: List[str]) -> int:
+def fast_copy(src: Path, dst: Path, st: os.stat_result) -> None:
     """
-    Copy non-Python files (like .tsv, .html, .css, .js)
+    Copy src to dst in kernel space where possible, preserving mtime
+
+    Uses os.copy_file_range (Linux) and falls back to a buffered userspace
+    copy when the call is unavailable or unsupported for these files.
 
     Args:
-        source_dir: Source directory
+        src: Source file path
+        dst: Destination file path
+        st: Stat result already captured for src
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        copied = 0
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while copied < st.st_size:
+                    n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), st.st_size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP):
+                    raise
+                copied = 0
+        if copied < st.st_size:
+            # Fallback: rewind both files and copy through userspace
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+            shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def copy_files(other_files: List[tuple], output_dir: Path) -> int:
+    """
+    Copy non-Python files (like .tsv, .html, .css, .js) found by scan_tree
+
+    Args:
+        other_files: List of (path, rel_path, stat_result) tuples
         output_dir: Output directory
-        extensions: List of file extensions to copy
 
     Returns:
         Number of files copied
     """
-    import shutil
     copied = 0
 
-    print(f"\n📄 Copying non-Python files:")
+    lines = []
+    for file_path, rel_path, st in other_files:
+        out_file = output_dir / rel_path
+        fast_copy(file_path, out_file, st)
 
-    for ext in extensions:
-        for file_path in source_dir.rglob(f'*{ext}'):
-            # Skip __pycache__ and other build artifacts
-            if '__pycache__' in str(file_path) or '.git' in str(file_path):
-                continue
+        lines.append(f"  Copied: {rel_path}\n")
+        copied += 1
+    sys.stdout.write(''.join(lines))
 
-            rel_path = file_path.relative_to(source_dir)
-            out_file = output_dir / rel_path
+    return copied
 
-            out_file.parent.mkdir(parents=True, exist_ok=True)
-            shutil.copy2(file_path, out_file)
 
-            print(f"  Copied: {rel_path}")
-            copied += 1
+def process_tree(
+    source_dir: Path,
+    output_dir: Path,
+    exclude_patterns: Set[str] = None,
+    copy_extensions: Set[str] = None
+) -> tuple:
+    """
+    Strip Python files and copy other assets in a single directory walk
 
-    return copied
+    Args:
+        source_dir: Source directory
+        output_dir: Output directory
+        exclude_patterns: Set of patterns to exclude
+        copy_extensions: Non-Python file extensions to copy verbatim
+
+    Returns:
+        Tuple of (processed_count, failed_count, copied_count)
+    """
+    if exclude_patterns is None:
+        exclude_patterns = {
+            '__pycache__',
+            '.git',
+            '.pytest_cache',
+            'build',
+            'dist',
+            '*.egg-info'
+        }
+    if copy_extensions is None:
+        copy_extensions = {'.tsv', '.html', '.css', '.js', '.json'}
+
+    python_files, other_files = scan_tree(source_dir, exclude_patterns, copy_extensions)
+
+    # Create every output directory up front instead of once per file
+    needed_dirs = {rel_path.parent for _, rel_path, _ in python_files + other_files}
+    for rel_dir in sorted(needed_dirs, key=lambda d: len(d.parts)):
+        os.makedirs(output_dir / rel_dir, exist_ok=True)
+
+    print(f"\n📦 Processing Python files:")
+    print(f"  Source: {source_dir}")
+    print(f"  Output: {output_dir}")
+    print()
+
+    processed, failed = process_python_files(python_files, output_dir)
+
+    print(f"\n📄 Copying non-Python files:")
+
+    copied = copy_files(other_files, output_dir)
+
+    return processed, failed, copied
 
 
 def main():
@@ -200,17 +529,14 @@ def main():
     print("LoanPilot Source Code Preprocessor")
     print("=" * 70)
 
-    # Process Python files
-    processed, failed = process_directory(
+    # Process Python files and copy non-Python files in one walk
+    processed, failed, copied = process_tree(
         source_dir,
         output_dir,
-        exclude_patterns={'__pycache__', '.git', 'tests', 'test_', '_test', 'build'}
+        exclude_patterns={'__pycache__', '.git', 'tests', 'test_*.py', '*_test.py', 'build'},
+        copy_extensions={'.tsv', '.html', '.css', '.js', '.json'}
     )
 
-    # Copy non-Python files
-    non_python_extensions = ['.tsv', '.html', '.css', '.js', '.json']
-    copied = copy_non_python_files(source_dir, output_dir, non_python_extensions)
-
     # Summary
     print()
     print("=" * 70)
@@ -6,12 +6,29 @@ Ensures API calls never fail due to model deprecation.
 """
 
 import os
+import re
+import json
+import time
 import logging
-from typing import Optional, Tuple, List
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Tuple, Set
 from anthropic import Anthropic, APIError
 
+try:
+    import fcntl
+except ImportError:  # Windows: persist without cross-process locking
+    fcntl = None
+
 logger = logging.getLogger(__name__)
 
+# Last known-good model per tier, shared across process restarts
+MODEL_CACHE_PATH = Path(
+    os.getenv('LOANPILOT_CACHE_DIR', str(Path.home() / '.cache' / 'loanpilot'))
+) / 'model_selection.json'
+MODEL_CACHE_TTL_SECONDS = 24 * 60 * 60
+
 
 class AdaptiveModelSelector:
     """
@@ -23,23 +40,30 @@ class AdaptiveModelSelector:
     # Each list is ordered from newest/preferred to most stable/fallback
     # Updated 2025-11-08 with current valid models - using aliases for auto-updates
     MODEL_CHAINS = {
-        'fast': [
+        'fast': (
             'claude-haiku-4-5',             # Latest Haiku 4.5 (fast, cost-effective) - auto-updates
             'claude-3-5-haiku-latest',      # Haiku 3.5 fallback - auto-updates
             'claude-3-haiku-20240307',      # Stable Haiku 3 fallback (specific version)
-        ],
-        'balanced': [
+        ),
+        'balanced': (
             'claude-sonnet-4-5',            # Latest Sonnet 4.5 (best balanced) - auto-updates
             'claude-3-7-sonnet-latest',     # Sonnet 3.7 fallback - auto-updates
             'claude-sonnet-4-0',            # Sonnet 4.0 fallback alias
-        ],
-        'powerful': [
+        ),
+        'powerful': (
             'claude-opus-4-1',              # Latest Opus 4.1 (most capable) - auto-updates
             'claude-opus-4-0',              # Opus 4.0 fallback alias
             'claude-sonnet-4-5',            # Sonnet 4.5 as final fallback
-        ]
+        )
     }
 
+    # Matches API errors caused by the model itself (deprecated/not found/invalid),
+    # in either "not found" or "not_found_error" form
+    _MODEL_ERR_RE = re.compile(
+        r'^(?=.*model)(?=.*(?:deprecated|not[_ ]found|invalid))',
+        re.IGNORECASE | re.DOTALL
+    )
+
     def __init__(self, client: Anthropic, tier: str = 'fast'):
         """
         Initialize adaptive model selector.
@@ -51,25 +75,32 @@ class AdaptiveModelSelector:
         self.client = client
         self.tier = tier
         self.successful_model: Optional[str] = None
-        self.failed_models: List[str] = []
-
-        # Allow environment variable override for model chain
-        env_model = os.getenv('ANTHROPIC_MODEL')
-        if env_model:
-            logger.info(f"Using environment-specified model: {env_model}")
-            self.model_chain = [env_model] + self.MODEL_CHAINS.get(tier, self.MODEL_CHAINS['fast'])
-        else:
-            self.model_chain = self.MODEL_CHAINS.get(tier, self.MODEL_CHAINS['fast'])
+        self.failed_models: Set[str] = set()
+
+        # Chain (including any ANTHROPIC_MODEL override) is resolved once per tier
+        # and shared read-only between instances
+        self.model_chain: Tuple[str, ...] = _resolve_model_chain(tier)
+
+        # Reuse a model that worked recently so new processes skip discovery
+        cached_model = _load_cached_model(tier, self.model_chain)
+        if cached_model:
+            logger.info(f"Using cached working model: {cached_model}")
+            self.successful_model = cached_model
+            self.model_chain = (cached_model,) + tuple(
+                m for m in self.model_chain if m != cached_model
+            )
 
         logger.info(f"Initialized adaptive model selector with tier '{tier}'")
         logger.info(f"Fallback chain: {' → '.join(self.model_chain)}")
 
-    def get_working_model(self, test_call: bool = False) -> str:
+    def get_working_model(self, test_call: bool = False, deep_test: bool = False) -> str:
         """
         Get a working model, testing with fallback if needed.
 
         Args:
             test_call: If True, make a test API call to verify model works
+            deep_test: If True, verify with a real inference call instead of
+                       a model metadata lookup
 
         Returns:
             Model name that is working
@@ -88,12 +119,13 @@ class AdaptiveModelSelector:
 
             if test_call:
                 # Test the model with a simple API call
-                if self._test_model(model):
+                if self._test_model(model, deep_test=deep_test):
                     self.successful_model = model
+                    _save_cached_model(self.tier, _resolve_model_chain(self.tier), model)
                     logger.info(f"✓ Selected working model: {model}")
                     return model
                 else:
-                    self.failed_models.append(model)
+                    self.failed_models.add(model)
                     logger.warning(f"✗ Model {model} failed test call, trying next...")
             else:
                 # Optimistically return the first model without testing
@@ -107,17 +139,83 @@ class AdaptiveModelSelector:
             f"All models in {self.tier} tier failed: {', '.join(self.model_chain)}"
         )
 
-    def _test_model(self, model: str) -> bool:
+    def get_working_model_parallel(self, max_concurrent: int = 3, deep_test: bool = False) -> str:
+        """
+        Like get_working_model(test_call=True), but probes candidates concurrently.
+
+        Discovery latency is bounded by the slowest probe needed rather than
+        the sum of all failing probes. Chain priority is preserved: the
+        earliest model in the chain whose probe succeeds is selected.
+
+        Args:
+            max_concurrent: Maximum number of probes in flight (rate-limit guard)
+            deep_test: If True, verify with a real inference call
+
+        Returns:
+            Model name that is working
+
+        Raises:
+            RuntimeError: If all models in chain fail
+        """
+        if self.successful_model:
+            return self.successful_model
+
+        candidates = [m for m in self.model_chain if m not in self.failed_models]
+
+        executor = ThreadPoolExecutor(max_workers=max(1, max_concurrent))
+        futures = [(model, executor.submit(self._test_model, model, deep_test)) for model in candidates]
+        try:
+            # Resolve in chain order; later probes keep running meanwhile
+            for model, future in futures:
+                if future.result():
+                    self.successful_model = model
+                    _save_cached_model(self.tier, _resolve_model_chain(self.tier), model)
+                    logger.info(f"✓ Selected working model: {model}")
+                    return model
+                self.failed_models.add(model)
+                logger.warning(f"✗ Model {model} failed test call, trying next...")
+        finally:
+            # Don't wait on lower-priority probes once a winner is known
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        # All models failed
+        raise RuntimeError(
+            f"All models in {self.tier} tier failed: {', '.join(self.model_chain)}"
+        )
+
+    @staticmethod
+    def _is_model_error(exc: Exception) -> bool:
+        """
+        Check whether an API error means the model itself is unusable.
+
+        Args:
+            exc: Exception raised by the Anthropic client
+
+        Returns:
+            True if the error mentions a deprecated, missing, or invalid model
+        """
+        return AdaptiveModelSelector._MODEL_ERR_RE.search(str(exc)) is not None
+
+    def _test_model(self, model: str, deep_test: bool = False) -> bool:
         """
         Test if a model is working with a minimal API call.
 
+        By default this looks the model up via the models endpoint, which
+        returns 404 for deprecated/unknown models without spending tokens.
+        Older SDKs without ``client.models`` fall back to an inference call.
+
         Args:
             model: Model name to test
+            deep_test: If True, send a tiny message instead of a metadata lookup
 
         Returns:
             True if model works, False otherwise
         """
         try:
+            if not deep_test and hasattr(self.client, 'models'):
+                self.client.models.retrieve(model)
+                return True
+
             response = self.client.messages.create(
                 model=model,
                 max_tokens=10,
@@ -126,15 +224,7 @@ class AdaptiveModelSelector:
             return response is not None and len(response.content) > 0
         except APIError as e:
             # Check if it's a model deprecation error
-            error_msg = str(e).lower()
-            is_model_error = (
-                'model' in error_msg and (
-                    'deprecated' in error_msg or
-                    'not found' in error_msg or
-                    'not_found' in error_msg  # Handle not_found_error
-                )
-            )
-            if is_model_error:
+            if self._is_model_error(e):
                 logger.warning(f"Model {model} is deprecated or not found: {e}")
                 return False
             # Other API errors might be transient, so we don't mark as failed
@@ -170,27 +260,17 @@ class AdaptiveModelSelector:
                 response = self.client.messages.create(**kwargs)
 
                 # Success! Mark this model as working
+                if self.successful_model != model:
+                    _save_cached_model(self.tier, _resolve_model_chain(self.tier), model)
                 self.successful_model = model
                 logger.info(f"✓ API call succeeded with model: {model}")
                 return response, model
 
             except APIError as e:
-                error_msg = str(e).lower()
-
                 # Check for model deprecation/not found errors
-                # Handle both "not found" and "not_found_error" formats
-                is_model_error = (
-                    'model' in error_msg and (
-                        'deprecated' in error_msg or
-                        'not found' in error_msg or
-                        'not_found' in error_msg or  # Handle not_found_error
-                        'invalid' in error_msg
-                    )
-                )
-
-                if is_model_error:
+                if self._is_model_error(e):
                     logger.warning(f"✗ Model {model} deprecated/unavailable: {e}")
-                    self.failed_models.append(model)
+                    self.failed_models.add(model)
                     last_error = e
                     continue  # Try next model
 
@@ -201,7 +281,7 @@ class AdaptiveModelSelector:
             except Exception as e:
                 # Unexpected error - log and try next model
                 logger.error(f"Unexpected error with model {model}: {e}")
-                self.failed_models.append(model)
+                self.failed_models.add(model)
                 last_error = e
                 continue
 
@@ -211,6 +291,96 @@ class AdaptiveModelSelector:
         )
 
 
+@functools.lru_cache(maxsize=8)
+def _resolve_model_chain(tier: str) -> Tuple[str, ...]:
+    """
+    Resolve the fallback chain for a tier, including any environment override.
+
+    The environment is read on first use rather than at import time so that
+    callers which run load_dotenv() after importing this module still see
+    ANTHROPIC_MODEL.
+
+    Args:
+        tier: Model tier - 'fast', 'balanced', or 'powerful'
+
+    Returns:
+        Tuple of model names in priority order
+    """
+    chain = AdaptiveModelSelector.MODEL_CHAINS.get(tier, AdaptiveModelSelector.MODEL_CHAINS['fast'])
+
+    # Allow environment variable override for model chain
+    env_model = os.getenv('ANTHROPIC_MODEL')
+    if env_model:
+        logger.info(f"Using environment-specified model: {env_model}")
+        # Dedupe in case the override is already part of the tier chain
+        return tuple(dict.fromkeys((env_model,) + chain))
+    return chain
+
+
+def _load_cached_model(tier: str, chain: Tuple[str, ...]) -> Optional[str]:
+    """
+    Load the last working model for a tier from the on-disk cache.
+
+    Args:
+        tier: Model tier
+        chain: Current fallback chain; entries recorded for a different
+               chain (e.g. after ANTHROPIC_MODEL changed) are ignored
+
+    Returns:
+        Cached model name, or None if missing, stale, or unusable
+    """
+    try:
+        with open(MODEL_CACHE_PATH, 'r') as f:
+            entry = json.load(f).get(tier)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+    if not isinstance(entry, dict):
+        return None
+    if time.time() - entry.get('ts', 0) > MODEL_CACHE_TTL_SECONDS:
+        return None
+    if entry.get('chain') != list(chain) or entry.get('model') not in chain:
+        return None
+    return entry['model']
+
+
+def _save_cached_model(tier: str, chain: Tuple[str, ...], model: str) -> None:
+    """
+    Record a working model for a tier in the on-disk cache.
+
+    Writes go through a temp file and os.replace so readers never see a
+    partial file; an flock serializes concurrent writers.
+
+    Args:
+        tier: Model tier
+        chain: Fallback chain the model was selected from
+        model: Model that succeeded
+    """
+    try:
+        MODEL_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with open(MODEL_CACHE_PATH.with_suffix('.lock'), 'w') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            try:
+                with open(MODEL_CACHE_PATH, 'r') as f:
+                    data = json.load(f)
+                if not isinstance(data, dict):
+                    data = {}
+            except (OSError, ValueError):
+                data = {}
+
+            data[tier] = {'model': model, 'chain': list(chain), 'ts': time.time()}
+
+            tmp_path = MODEL_CACHE_PATH.with_suffix(f'.{os.getpid()}.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, MODEL_CACHE_PATH)
+    except OSError as e:
+        # Cache is best-effort (e.g. read-only home in containers)
+        logger.debug(f"Could not persist model selection: {e}")
+
+
 def create_adaptive_selector(client: Anthropic, tier: str = 'fast') -> AdaptiveModelSelector:
     """
     Factory function to create an adaptive model selector.
@@ -225,6 +395,7 @@ def create_adaptive_selector(client: Anthropic, tier: str = 'fast') -> AdaptiveM
     return AdaptiveModelSelector(client, tier)
 
 
+@functools.lru_cache(maxsize=8)
 def get_model_for_tier(tier: str = 'fast') -> str:
     """
     Get the preferred model for a tier without making API calls.
@@ -236,10 +407,5 @@ def get_model_for_tier(tier: str = 'fast') -> str:
     Returns:
         Model name (first in chain for that tier)
     """
-    # Check environment override first
-    env_model = os.getenv('ANTHROPIC_MODEL')
-    if env_model:
-        return env_model
-
-    chain = AdaptiveModelSelector.MODEL_CHAINS.get(tier, AdaptiveModelSelector.MODEL_CHAINS['fast'])
-    return chain[0]
+    # Environment override, if any, is first in the resolved chain
+    return _resolve_model_chain(tier)[0]
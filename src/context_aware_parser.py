@@ -6,14 +6,105 @@ Provides formal script interfaces and context to Anthropic for accurate routing.
 
 import sqlite3
 import os
+import re
 import json
+import string
+import time
+import difflib
+import hashlib
 import logging
-from typing import Dict, List, Optional, Any
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import CodeType, MappingProxyType
+from typing import Dict, List, Optional, Tuple, Any
 from anthropic import Anthropic
 from .adaptive_model_selector import create_adaptive_selector
 
+try:
+    from rapidfuzz import process as fuzz_process, fuzz
+except ImportError:  # Fall back to difflib when rapidfuzz isn't installed
+    fuzz_process = fuzz = None
+
 logger = logging.getLogger(__name__)
 
+# Parsed query -> tool selection results are cached in the database so repeated
+# queries skip the model round-trip. QUERY_CACHE_TTL=0 disables the cache.
+DEFAULT_QUERY_CACHE_TTL = 24 * 60 * 60
+
+# Upper bound on memoized parameter-name mappings per parser
+PARAM_NAME_CACHE_SIZE = 1024
+
+# Default cap on in-flight real-time requests (rate-limit guard)
+MAX_CONCURRENT_REQUESTS = 10
+
+# Queries longer than this are truncated before being sent to the model
+DEFAULT_MAX_QUERY_CHARS = 4000
+
+# programs_v3 columns per (database path, schema_version), shared by all parsers
+# in the process; schema_version changes whenever the schema does
+_COLUMNS_BY_SCHEMA: Dict[Tuple[str, int], Tuple[str, ...]] = {}
+
+# Common natural-language aliases for database columns
+_PARAM_ALIASES = MappingProxyType({
+    'citizenship': 'citizenship',
+    'appraisal': 'appraisal_requirements',
+    'appraisals': 'appraisal_requirements',
+    'reserves': 'reserves',
+    'reserve': 'reserves',
+    'documentation': 'income_documentation',
+    'docs': 'income_documentation',
+    'occupancy': 'occupancy',
+    'transaction': 'transaction_type',
+    'credit': 'borrower_credit_score',
+    'ltv': 'ltv',
+    'dti': 'dti',
+    'loan_amount': 'loan_amount'
+})
+
+# Lowercases ASCII letters and turns spaces into underscores in one pass
+_PARAM_NAME_TABLE = str.maketrans(string.ascii_uppercase + ' ', string.ascii_lowercase + '_')
+
+# Parameter keywords recognised without the model ("loan_amount" also matches "loan amount")
+_PARAM_KEYWORD_RE = re.compile(
+    r"\b(" + "|".join(re.escape(k).replace("_", "[ _]") for k in _PARAM_ALIASES) + r")\b",
+    re.IGNORECASE | re.ASCII
+)
+
+# Questions that ask which programs fit, rather than for a parameter's values;
+# these are eligibility searches for match_programs, not direct lookups
+_PROGRAM_SEARCH_RE = re.compile(
+    r"\b(?:which|what|any)\s+(?:of\s+(?:these|the|my)\s+(?:selected\s+)?)?programs?\b",
+    re.IGNORECASE
+)
+_ELIGIBILITY_RE = re.compile(
+    r"\b(?:allows?|allowed|accepts?|accepted|permits?|permitted|eligible|eligibility|qualify|qualifies"
+    r"|without|no)\b|\bnon[- ]",
+    re.IGNORECASE
+)
+
+# Routing system prompt, filled with the database columns once per parser. The
+# per-query user context goes in the user message so the system block stays
+# identical across requests and can be served from Anthropic's prompt cache.
+SYSTEM_PROMPT_TEMPLATE = """You are an expert at routing loan program queries to the correct database script.
+
+Database Schema - Available parameter columns:
+{columns}
+
+Your task:
+1. Understand what the user is asking about
+2. Map natural language to the correct database column name
+3. Choose the appropriate script tool with correct parameters
+4. If programs are selected (see User Context in the message), use them in selected_programs parameter
+
+Common parameter mappings:
+- "appraisal requirements" → appraisal_requirements
+- "citizenship requirements" → citizenship
+- "reserve requirements" → reserves
+- "documentation requirements" → income_documentation
+- "occupancy requirements" → occupancy
+"""
+
 
 class ContextAwareParser:
     """
@@ -21,44 +112,177 @@ class ContextAwareParser:
     Uses tool/function calling pattern for accurate parameter extraction.
     """
 
-    def __init__(self, db_path='loanpilot.db'):
+    def __init__(self, db_path='loanpilot.db', max_query_chars: int = DEFAULT_MAX_QUERY_CHARS):
         self.db_path = os.environ.get('DB_PATH', db_path)
+        self._db_is_uri = self.db_path.startswith('file:')
         self.scratchpad_path = os.environ.get('SCRATCHPAD_PATH', '.scratchpad')
+        self.max_query_chars = max_query_chars
 
-        # Initialize Anthropic client with adaptive model selection
-        api_key = os.getenv('ANTHROPIC_API_KEY')
-        if not api_key:
-            print("⚠️  ANTHROPIC_API_KEY not found - context-aware parsing will fail")
-            self.anthropic = None
-            self.model_selector = None
-        else:
-            self.anthropic = Anthropic(api_key=api_key)
-            # Use 'balanced' tier for context-aware parsing (needs good reasoning)
-            self.model_selector = create_adaptive_selector(self.anthropic, tier='balanced')
+        # Anthropic client and model selector are created on first use
+        self._api_key = os.getenv('ANTHROPIC_API_KEY')
+        if not self._api_key:
+            logger.warning("⚠️  ANTHROPIC_API_KEY not found - context-aware parsing will fail")
+
+        # One connection serves every lookup; the lock serializes cross-thread use
+        self._db_lock = threading.Lock()
+        self._conn = self._open_connection()
 
         # Load database schema and scripts
         self.db_columns = self._get_database_columns()
+        self._db_columns_set = frozenset(self.db_columns)
+        self._db_columns_lower = [c.lower() for c in self.db_columns]
+        self._param_name_cache: Dict[str, Optional[str]] = {}
+        self._script_cache: Dict[str, Tuple[str, CodeType]] = {}
+        self._columns_csv = ', '.join(self.db_columns)
         self.script_tools = self._build_script_tools()
+        self.system_prompt = [{
+            "type": "text",
+            "text": SYSTEM_PROMPT_TEMPLATE.format(columns=self._columns_csv),
+            "cache_control": {"type": "ephemeral"}
+        }]
+
+        self.query_cache_ttl = int(os.environ.get('QUERY_CACHE_TTL', DEFAULT_QUERY_CACHE_TTL))
+        self._query_cache_enabled = self.query_cache_ttl > 0 and self._init_query_cache()
+
+        logger.info(
+            "✓ Context-aware parser initialized (%d database columns, %d script tools)",
+            len(self.db_columns), len(self.script_tools)
+        )
 
-        print(f"✓ Context-aware parser initialized")
-        print(f"  - {len(self.db_columns)} database columns")
-        print(f"  - {len(self.script_tools)} script tools")
+    @functools.cached_property
+    def anthropic(self) -> Optional[Anthropic]:
+        """Anthropic client, or None when no API key is configured."""
+        if not self._api_key:
+            return None
+        return Anthropic(api_key=self._api_key)
+
+    @functools.cached_property
+    def model_selector(self):
+        """Adaptive model selector for the client, or None without a client."""
+        if not self.anthropic:
+            return None
+        # Use 'balanced' tier for context-aware parsing (needs good reasoning)
+        return create_adaptive_selector(self.anthropic, tier='balanced')
+
+    def _open_connection(self) -> sqlite3.Connection:
+        """Open the parser's long-lived database connection (db_path may be a file: URI)."""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, uri=self._db_is_uri)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA cache_size=-20000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
+        if os.environ.get('LOANPILOT_SQLITE_WAL') == '1':
+            # Opt-in: WAL persistently converts the database and keeps -wal/-shm
+            # files beside it, so the whole directory must be shared with other tools
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+            except sqlite3.Error as e:
+                # Read-only databases keep their existing journal mode
+                logger.warning("Could not enable WAL mode: %s", e)
+        return conn
+
+    def close(self) -> None:
+        """Close the parser's database connection."""
+        with self._db_lock:
+            self._conn.close()
+
+    def _get_database_columns(self) -> Tuple[str, ...]:
+        """Get all columns in programs_v3 table (cached per schema version)."""
+        with self._db_lock:
+            schema_version = self._conn.execute("PRAGMA schema_version").fetchone()[0]
+            key = (self.db_path if self._db_is_uri else os.path.abspath(self.db_path), schema_version)
+            columns = _COLUMNS_BY_SCHEMA.get(key)
+            if columns is None:
+                columns = tuple(row[1] for row in self._conn.execute("PRAGMA table_info(programs_v3)"))
+                _COLUMNS_BY_SCHEMA[key] = columns
+            return columns
+
+    def _init_query_cache(self) -> bool:
+        """
+        Create the query_cache table if needed and drop expired rows.
 
-    def _get_database_columns(self) -> List[str]:
-        """Get list of all columns in programs_v3 table."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA table_info(programs_v3)")
-        columns = [row[1] for row in cursor.fetchall()]
-        conn.close()
-        return columns
+        Returns:
+            True if the cache is usable, False if the database is read-only or unavailable
+        """
+        try:
+            with self._db_lock, self._conn:
+                self._conn.execute("""
+                    CREATE TABLE IF NOT EXISTS query_cache (
+                        key TEXT PRIMARY KEY,
+                        result TEXT NOT NULL,
+                        created_at INTEGER NOT NULL
+                    )
+                """)
+                # Lookups go through the primary key; this index serves pruning
+                self._conn.execute("DROP INDEX IF EXISTS idx_query_cache_key_created")
+                self._conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_query_cache_created ON query_cache(created_at)"
+                )
+                self._prune_query_cache()
+            return True
+        except sqlite3.Error as e:
+            logger.warning("⚠️  Query cache disabled: %s", e)
+            return False
+
+    @staticmethod
+    def _query_cache_key(query: str,
+                         selected_programs: Optional[List[str]],
+                         selected_servicers: Optional[List[str]]) -> str:
+        """Build the cache key from the query and its (order-insensitive) context."""
+        payload = json.dumps([
+            query,
+            sorted(selected_programs or []),
+            sorted(selected_servicers or []),
+        ])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _get_cached_selection(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a cached tool selection younger than the TTL, if any."""
+        try:
+            with self._db_lock:
+                row = self._conn.execute(
+                    "SELECT result FROM query_cache WHERE key = ? AND created_at >= ?",
+                    (key, int(time.time()) - self.query_cache_ttl)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Query cache lookup failed: %s", e)
+            return None
+
+        return json.loads(row[0]) if row else None
+
+    def _store_cached_selection(self, key: str, result: Dict[str, Any]) -> None:
+        """Cache a successful tool selection (script name and parameters only)."""
+        try:
+            payload = json.dumps({
+                "script_name": result["script_name"],
+                "parameters": result["parameters"],
+            })
+        except (TypeError, ValueError):
+            return
+
+        try:
+            with self._db_lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO query_cache (key, result, created_at) VALUES (?, ?, ?)",
+                    (key, payload, int(time.time()))
+                )
+                self._prune_query_cache()
+        except sqlite3.Error as e:
+            logger.warning("Query cache write failed: %s", e)
+
+    def _prune_query_cache(self) -> None:
+        """Delete rows past the TTL (caller holds the lock and the transaction)."""
+        self._conn.execute(
+            "DELETE FROM query_cache WHERE created_at < ?",
+            (int(time.time()) - self.query_cache_ttl,)
+        )
 
-    def _build_script_tools(self) -> List[Dict[str, Any]]:
+    def _build_script_tools(self) -> Tuple[Dict[str, Any], ...]:
         """
         Build structured tool definitions for each script.
         These will be passed to Anthropic for function calling.
         """
-        tools = [
+        tools = (
             {
                 "name": "find_param_across_programs",
                 "description": "Query a specific parameter across multiple programs. Use when user asks about a parameter (citizenship, appraisal, reserves, etc.) with selected programs.",
@@ -67,7 +291,7 @@ class ContextAwareParser:
                     "properties": {
                         "param_name": {
                             "type": "string",
-                            "description": f"Database column name. Available: {', '.join(self.db_columns)}",
+                            "description": f"Database column name. Available: {self._columns_csv}",
                             "enum": self.db_columns
                         },
                         "loan_servicer": {
@@ -117,98 +341,220 @@ class ContextAwareParser:
                         "occupancy": {"type": "string"}
                     },
                     "required": []
-                }
+                },
+                # Tool definitions never change between requests; cache them too
+                "cache_control": {"type": "ephemeral"}
             }
-        ]
+        )
         return tools
 
     def _map_param_name(self, user_param: str) -> Optional[str]:
         """
         Map user's natural language parameter name to database column.
+        Results are memoized per parser since the column list is fixed.
+        """
+        try:
+            return self._param_name_cache[user_param]
+        except KeyError:
+            pass
+
+        mapped = self._match_param_name(user_param)
+        if len(self._param_name_cache) >= PARAM_NAME_CACHE_SIZE:
+            self._param_name_cache.clear()
+        self._param_name_cache[user_param] = mapped
+        return mapped
+
+    def _match_param_name(self, user_param: str) -> Optional[str]:
+        """
+        Match a parameter name against database columns.
         Uses fuzzy matching and common aliases.
         """
-        user_param_lower = user_param.lower().replace(' ', '_')
+        if user_param.isascii():
+            user_param_lower = user_param.translate(_PARAM_NAME_TABLE)
+        else:
+            user_param_lower = user_param.lower().replace(' ', '_')
 
         # Direct match
-        if user_param_lower in self.db_columns:
+        if user_param_lower in self._db_columns_set:
             return user_param_lower
 
         # Common aliases
-        aliases = {
-            'citizenship': 'citizenship',
-            'appraisal': 'appraisal_requirements',
-            'appraisals': 'appraisal_requirements',
-            'reserves': 'reserves',
-            'reserve': 'reserves',
-            'documentation': 'income_documentation',
-            'docs': 'income_documentation',
-            'occupancy': 'occupancy',
-            'transaction': 'transaction_type',
-            'credit': 'borrower_credit_score',
-            'ltv': 'ltv',
-            'dti': 'dti',
-            'loan_amount': 'loan_amount'
-        }
-
-        if user_param_lower in aliases:
-            return aliases[user_param_lower]
+        if user_param_lower in _PARAM_ALIASES:
+            return _PARAM_ALIASES[user_param_lower]
 
         # Fuzzy match
-        import difflib
-        matches = difflib.get_close_matches(user_param_lower, self.db_columns, n=1, cutoff=0.6)
-        if matches:
-            return matches[0]
+        if fuzz_process is not None:
+            match = fuzz_process.extractOne(
+                user_param_lower, self._db_columns_lower,
+                scorer=fuzz.ratio, score_cutoff=60
+            )
+            if match:
+                return self.db_columns[match[2]]
+        else:
+            matches = difflib.get_close_matches(user_param_lower, self.db_columns, n=1, cutoff=0.6)
+            if matches:
+                return matches[0]
 
         return None
 
-    def parse_query_with_context(
+    def _clip_query(self, query: str) -> str:
+        """Truncate an oversized query at a word boundary so its input cost is bounded."""
+        if len(query) <= self.max_query_chars:
+            return query
+
+        clipped = query[:self.max_query_chars]
+        if not query[self.max_query_chars].isspace():
+            head, sep, _ = clipped.rpartition(' ')
+            if sep:
+                clipped = head
+        logger.warning(
+            "Query of %d characters truncated to %d before parsing",
+            len(query), len(clipped)
+        )
+        return clipped.rstrip()
+
+    @staticmethod
+    def _build_context_message(
+        selected_programs: List[str] = None,
+        selected_servicers: List[str] = None
+    ) -> str:
+        """Build the per-query user context that accompanies the query."""
+        # Build context message
+        context_parts = []
+        if selected_programs:
+            context_parts.append(f"Selected programs: {', '.join(selected_programs)}")
+        if selected_servicers:
+            context_parts.append(f"Servicers: {', '.join(selected_servicers)}")
+
+        context_message = "\n".join(context_parts) if context_parts else "No programs selected"
+        return f"User Context:\n{context_message}"
+
+    def _match_direct_param_query(
         self,
         query: str,
         selected_programs: List[str] = None,
         selected_servicers: List[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Route a parameter question about the selected programs without the model.
+
+        Applies only when the query names exactly one known parameter, programs are
+        selected, and a single servicer can be determined. Eligibility questions
+        (which programs allow/accept X, without X, non-X) are left to the model
+        along with anything else.
+
+        Returns:
+            Parse result for find_param_across_programs, or None to fall through
+        """
+        # Numbers ("credit 700", "ltv 80") describe a borrower profile for match_programs
+        if not selected_programs or any(ch.isdigit() for ch in query):
+            return None
+
+        # "Which of these programs allow non-owner occupancy?" is a search, not a lookup
+        if _PROGRAM_SEARCH_RE.search(query) or _ELIGIBILITY_RE.search(query):
+            return None
+
+        columns = {
+            _PARAM_ALIASES[m.group(1).translate(_PARAM_NAME_TABLE)]
+            for m in _PARAM_KEYWORD_RE.finditer(query)
+        }
+        if len(columns) != 1:
+            return None
+        param_name = columns.pop()
+        if param_name not in self._db_columns_set:
+            return None
+
+        if selected_servicers:
+            servicers = set(selected_servicers)
+        else:
+            servicers = {
+                'Prime' if p.startswith('PRMG/') else
+                'LoanStream' if p.startswith('LoanStream') else None
+                for p in selected_programs
+            }
+        if len(servicers) != 1 or None in servicers:
+            return None
+
+        return {
+            "script_name": "find_param_across_programs",
+            "parameters": {
+                "param_name": param_name,
+                "loan_servicer": servicers.pop(),
+                "selected_programs": selected_programs
+            },
+            "confidence": 0.95,
+            "reasoning": f"Direct keyword match for '{param_name}'"
+        }
+
+    def _extract_tool_selection(
+        self,
+        content: List[Any],
+        selected_programs: List[str] = None,
+        selected_servicers: List[str] = None
     ) -> Dict[str, Any]:
         """
-        Parse query using Anthropic with full context awareness.
+        Turn the first tool_use block of a response into a parse result.
 
         Args:
-            query: User's natural language query
+            content: Response content blocks
             selected_programs: List of selected program names
             selected_servicers: List of selected servicers
 
         Returns:
             Dict with script_name, parameters, and confidence
         """
-        # Build context message
-        context_parts = []
-        if selected_programs:
-            context_parts.append(f"Selected programs: {', '.join(selected_programs)}")
-        if selected_servicers:
-            context_parts.append(f"Servicers: {', '.join(selected_servicers)}")
-
-        context_message = "\n".join(context_parts) if context_parts else "No programs selected"
-
-        # Build system prompt
-        system_prompt = f"""You are an expert at routing loan program queries to the correct database script.
+        for block in content:
+            if block.type == "tool_use":
+                tool_name = block.name
+                tool_input = block.input
+
+                logger.debug("Anthropic selected tool %s with parameters %s", tool_name, tool_input)
+
+                # Add selected_programs if provided and not in tool_input
+                if selected_programs and 'selected_programs' not in tool_input:
+                    tool_input['selected_programs'] = selected_programs
+
+                # Infer servicer from selected programs if not provided
+                if 'loan_servicer' in tool_input and not tool_input.get('loan_servicer'):
+                    if selected_servicers:
+                        tool_input['loan_servicer'] = selected_servicers[0]
+                    elif selected_programs and selected_programs[0].startswith('PRMG/'):
+                        tool_input['loan_servicer'] = 'Prime'
+
+                return {
+                    "script_name": tool_name,
+                    "parameters": tool_input,
+                    "confidence": 0.95,
+                    "reasoning": getattr(block, 'reasoning', None)
+                }
 
-Database Schema - Available parameter columns:
-{', '.join(self.db_columns)}
+        # No tool use found
+        return {
+            "script_name": None,
+            "parameters": {},
+            "confidence": 0.0,
+            "error": "No matching script found"
+        }
 
-User Context:
-{context_message}
+    def parse_query_with_context(
+        self,
+        query: str,
+        selected_programs: List[str] = None,
+        selected_servicers: List[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Parse query using Anthropic with full context awareness.
 
-Your task:
-1. Understand what the user is asking about
-2. Map natural language to the correct database column name
-3. Choose the appropriate script tool with correct parameters
-4. If programs are selected, use them in selected_programs parameter
+        Args:
+            query: User's natural language query
+            selected_programs: List of selected program names
+            selected_servicers: List of selected servicers
 
-Common parameter mappings:
-- "appraisal requirements" → appraisal_requirements
-- "citizenship requirements" → citizenship
-- "reserve requirements" → reserves
-- "documentation requirements" → income_documentation
-- "occupancy requirements" → occupancy
-"""
+        Returns:
+            Dict with script_name, parameters, and confidence
+        """
+        query = self._clip_query(query)
+        context_message = self._build_context_message(selected_programs, selected_servicers)
 
         # Check if Anthropic client is available
         if not self.anthropic or not self.model_selector:
@@ -219,63 +565,248 @@ Common parameter mappings:
                 "error": "Anthropic API not available (missing API key)"
             }
 
+        direct = self._match_direct_param_query(query, selected_programs, selected_servicers)
+        if direct is not None:
+            logger.info(
+                f"Context-aware parsing matched '{direct['parameters']['param_name']}' "
+                f"directly (confidence {direct['confidence']})"
+            )
+            return direct
+
+        cache_key = None
+        if self._query_cache_enabled:
+            cache_key = self._query_cache_key(query, selected_programs, selected_servicers)
+            cached = self._get_cached_selection(cache_key)
+            if cached is not None:
+                logger.info("Context-aware parsing served from query cache")
+                cached["confidence"] = 0.95
+                cached["reasoning"] = "Cached tool selection"
+                return cached
+
         # Call Anthropic with tool use and adaptive model selection
         try:
             response, model_used = self.model_selector.call_with_fallback(
                 max_tokens=1024,
                 temperature=0,
-                system=system_prompt,
+                system=self.system_prompt,
                 messages=[{
                     "role": "user",
-                    "content": f"Query: {query}"
+                    "content": f"{context_message}\n\nQuery: {query}"
                 }],
                 tools=self.script_tools
             )
-            logger.info(f"Context-aware parsing used model: {model_used}")
+            logger.info("Context-aware parsing used model: %s", model_used)
 
             # Extract tool use from response
-            for block in response.content:
-                if block.type == "tool_use":
-                    tool_name = block.name
-                    tool_input = block.input
-
-                    print(f"✓ Anthropic selected tool: {tool_name}")
-                    print(f"✓ Tool parameters: {json.dumps(tool_input, indent=2)}")
-
-                    # Add selected_programs if provided and not in tool_input
-                    if selected_programs and 'selected_programs' not in tool_input:
-                        tool_input['selected_programs'] = selected_programs
-
-                    # Infer servicer from selected programs if not provided
-                    if 'loan_servicer' in tool_input and not tool_input.get('loan_servicer'):
-                        if selected_servicers:
-                            tool_input['loan_servicer'] = selected_servicers[0]
-                        elif selected_programs and selected_programs[0].startswith('PRMG/'):
-                            tool_input['loan_servicer'] = 'Prime'
-
-                    return {
-                        "script_name": tool_name,
-                        "parameters": tool_input,
-                        "confidence": 0.95,
-                        "reasoning": getattr(block, 'reasoning', None)
-                    }
-
-            # No tool use found
+            result = self._extract_tool_selection(
+                response.content, selected_programs, selected_servicers
+            )
+            if cache_key and result.get("script_name"):
+                self._store_cached_selection(cache_key, result)
+            return result
+
+        except Exception as e:
+            logger.error("❌ Anthropic query parsing failed: %s", e)
             return {
                 "script_name": None,
                 "parameters": {},
                 "confidence": 0.0,
-                "error": "No matching script found"
+                "error": str(e)
             }
 
-        except Exception as e:
-            print(f"❌ Anthropic query parsing failed: {e}")
-            return {
+    def parse_queries_concurrent(
+        self,
+        queries: List[str],
+        selected_programs: List[str] = None,
+        selected_servicers: List[str] = None,
+        max_concurrent: int = MAX_CONCURRENT_REQUESTS
+    ) -> List[Dict[str, Any]]:
+        """
+        Parse queries with one real-time request each, several in flight at once.
+
+        Requests are I/O bound, so N queries finish in roughly the slowest
+        request's latency instead of the sum of all of them.
+
+        Args:
+            queries: User queries to parse
+            selected_programs: List of selected program names (shared by all queries)
+            selected_servicers: List of selected servicers (shared by all queries)
+            max_concurrent: Maximum number of requests in flight
+
+        Returns:
+            One parse result dict per query, in input order
+        """
+        if not self.anthropic or not self.model_selector or len(queries) <= 1:
+            return [
+                self.parse_query_with_context(q, selected_programs, selected_servicers)
+                for q in queries
+            ]
+
+        workers = max(1, min(max_concurrent, len(queries)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(
+                lambda q: self.parse_query_with_context(q, selected_programs, selected_servicers),
+                queries
+            ))
+
+    def parse_queries_bulk(
+        self,
+        queries: List[str],
+        selected_programs: List[str] = None,
+        selected_servicers: List[str] = None,
+        max_per_request: int = 10
+    ) -> List[Dict[str, Any]]:
+        """
+        Parse several queries in one real-time request per group of queries.
+
+        The queries are numbered in a single user message and the model is
+        asked for one tool call per query, in order, so the system prompt and
+        tool definitions are sent once per group instead of once per query.
+        Groups whose response has fewer tool calls than queries are re-parsed
+        with one concurrent request per query.
+
+        Args:
+            queries: User queries to parse
+            selected_programs: List of selected program names (shared by all queries)
+            selected_servicers: List of selected servicers (shared by all queries)
+            max_per_request: Maximum queries per request (accuracy drops beyond ~10-15)
+
+        Returns:
+            One parse result dict per query, in input order
+        """
+        if not self.anthropic or not self.model_selector or len(queries) <= 1:
+            return [
+                self.parse_query_with_context(q, selected_programs, selected_servicers)
+                for q in queries
+            ]
+
+        context_message = self._build_context_message(selected_programs, selected_servicers)
+        parsed: List[Dict[str, Any]] = []
+
+        for start in range(0, len(queries), max_per_request):
+            group = queries[start:start + max_per_request]
+            numbered = "\n".join(f"{i + 1}. {self._clip_query(q)}" for i, q in enumerate(group))
+
+            tool_blocks = []
+            try:
+                response, model_used = self.model_selector.call_with_fallback(
+                    max_tokens=1024 * len(group),
+                    temperature=0,
+                    system=self.system_prompt,
+                    messages=[{
+                        "role": "user",
+                        "content": (
+                            f"{context_message}\n\n"
+                            f"Solve each of the following {len(group)} queries independently. "
+                            f"Make exactly one tool call per query, in the same order as listed.\n\n"
+                            f"Queries:\n{numbered}"
+                        )
+                    }],
+                    tools=self.script_tools
+                )
+                logger.info("Bulk parsing of %d queries used model: %s", len(group), model_used)
+                tool_blocks = [b for b in response.content if b.type == "tool_use"]
+            except Exception as e:
+                logger.error("❌ Anthropic bulk query parsing failed: %s", e)
+
+            if len(tool_blocks) < len(group):
+                # Can't align calls to queries reliably; parse individually
+                parsed.extend(
+                    self.parse_queries_concurrent(group, selected_programs, selected_servicers)
+                )
+                continue
+
+            parsed.extend(
+                self._extract_tool_selection([block], selected_programs, selected_servicers)
+                for block in tool_blocks[:len(group)]
+            )
+
+        return parsed
+
+    def parse_queries_batch(
+        self,
+        queries: List[str],
+        selected_programs: List[str] = None,
+        selected_servicers: List[str] = None,
+        poll_interval: float = 5.0,
+        timeout: float = 3600.0
+    ) -> List[Dict[str, Any]]:
+        """
+        Parse many queries with a single Anthropic Message Batches job.
+
+        Batches are billed at a discount and amortize request overhead, but
+        can take minutes to complete, so this suits bulk/offline work rather
+        than interactive queries.
+
+        Args:
+            queries: User queries to parse
+            selected_programs: List of selected program names (shared by all queries)
+            selected_servicers: List of selected servicers (shared by all queries)
+            poll_interval: Seconds between batch status checks
+            timeout: Maximum seconds to wait for the batch to end
+
+        Returns:
+            One parse result dict per query, in input order
+
+        Raises:
+            RuntimeError: If the Anthropic client or batches API is unavailable,
+                          or the batch does not end within timeout
+        """
+        if not self.anthropic or not self.model_selector:
+            raise RuntimeError("Anthropic API not available (missing API key)")
+        if not hasattr(self.anthropic.messages, 'batches'):
+            raise RuntimeError("Installed anthropic SDK does not support message batches")
+
+        context_message = self._build_context_message(selected_programs, selected_servicers)
+        model = self.model_selector.get_working_model()
+
+        batch = self.anthropic.messages.batches.create(requests=[
+            {
+                "custom_id": f"q{i}",
+                "params": {
+                    "model": model,
+                    "max_tokens": 1024,
+                    "temperature": 0,
+                    "system": self.system_prompt,
+                    "tools": self.script_tools,
+                    "messages": [{
+                        "role": "user",
+                        "content": f"{context_message}\n\nQuery: {self._clip_query(query)}"
+                    }]
+                }
+            }
+            for i, query in enumerate(queries)
+        ])
+        logger.info("Submitted batch %s with %d queries using model: %s", batch.id, len(queries), model)
+
+        # Poll until the batch has ended
+        deadline = time.monotonic() + timeout
+        while batch.processing_status != "ended":
+            if time.monotonic() >= deadline:
+                raise RuntimeError(f"Batch {batch.id} did not finish within {timeout}s")
+            time.sleep(poll_interval)
+            batch = self.anthropic.messages.batches.retrieve(batch.id)
+
+        # Map results back to query order via custom_id
+        parsed: List[Dict[str, Any]] = [
+            {
                 "script_name": None,
                 "parameters": {},
                 "confidence": 0.0,
-                "error": str(e)
+                "error": "No result returned for query"
             }
+            for _ in queries
+        ]
+        for entry in self.anthropic.messages.batches.results(batch.id):
+            idx = int(entry.custom_id[1:])
+            if entry.result.type == "succeeded":
+                parsed[idx] = self._extract_tool_selection(
+                    entry.result.message.content, selected_programs, selected_servicers
+                )
+            else:
+                parsed[idx]["error"] = f"Batch request {entry.result.type}"
+
+        return parsed
 
     def execute_script(self, script_name: str, parameters: Dict[str, Any]) -> bool:
         """
@@ -283,11 +814,10 @@ Common parameter mappings:
         Loads script from database and executes with proper context.
         """
         # Load script from database
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT script FROM scripts WHERE name = ?", (script_name,))
-        row = cursor.fetchone()
-        conn.close()
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT script FROM scripts WHERE name = ?", (script_name,)
+            ).fetchone()
 
         if not row:
             with open(self.scratchpad_path, 'w') as f:
@@ -306,7 +836,7 @@ Common parameter mappings:
 
         # Execute script
         try:
-            exec(script_code, exec_globals)
+            exec(self._compile_script(script_name, script_code), exec_globals)
             return True
         except SystemExit:
             # Scripts may call exit() - treat as success
@@ -316,6 +846,16 @@ Common parameter mappings:
                 f.write(f"Error executing script: {str(e)}\n")
             return False
 
+    def _compile_script(self, script_name: str, script_code: str) -> CodeType:
+        """Compile a script, reusing the cached code object while its source is unchanged."""
+        cached = self._script_cache.get(script_name)
+        if cached is not None and cached[0] == script_code:
+            return cached[1]
+
+        code = compile(script_code, f"<script:{script_name}>", "exec")
+        self._script_cache[script_name] = (script_code, code)
+        return code
+
     def parse_and_execute(
         self,
         query: str,
@@ -345,6 +885,70 @@ Common parameter mappings:
         # Execute script
         return self.execute_script(result['script_name'], result['parameters'])
 
+    def parse_and_execute_many(
+        self,
+        queries: List[str],
+        selected_programs: List[str] = None,
+        selected_servicers: List[str] = None,
+        use_batch: bool = False,
+        poll_interval: float = 5.0,
+        timeout: float = 3600.0
+    ) -> List[Dict[str, Any]]:
+        """
+        Parse and execute several queries, optionally through one batch job.
+
+        Each script overwrites the scratchpad, so its contents are captured
+        after every execution.
+
+        Args:
+            queries: User queries
+            selected_programs: List of selected program names
+            selected_servicers: List of selected servicers
+            use_batch: Parse through the Message Batches API instead of
+                       real-time requests; falls back to real-time bulk parsing
+                       if the batch cannot be completed
+            poll_interval: Seconds between batch status checks
+            timeout: Maximum seconds to wait for the batch
+
+        Returns:
+            List of dicts with query, success, and results (scratchpad text)
+        """
+        queries = [q[1:].strip() if q.startswith('^') else q for q in queries]
+
+        parsed = None
+        if use_batch and queries:
+            try:
+                parsed = self.parse_queries_batch(
+                    queries,
+                    selected_programs=selected_programs,
+                    selected_servicers=selected_servicers,
+                    poll_interval=poll_interval,
+                    timeout=timeout
+                )
+            except Exception as e:
+                logger.warning("Batch parsing unavailable, using real-time requests: %s", e)
+
+        if parsed is None:
+            parsed = self.parse_queries_bulk(
+                queries,
+                selected_programs=selected_programs,
+                selected_servicers=selected_servicers
+            )
+
+        outcomes = []
+        for query, result in zip(queries, parsed):
+            if result['script_name']:
+                success = self.execute_script(result['script_name'], result['parameters'])
+            else:
+                success = False
+                with open(self.scratchpad_path, 'w') as f:
+                    f.write(f"Error: {result.get('error', 'No matching script found')}\n")
+
+            with open(self.scratchpad_path, 'r') as f:
+                outcomes.append({"query": query, "success": success, "results": f.read()})
+
+        return outcomes
+
 
 def main():
     """Test the context-aware parser."""
@@ -355,6 +959,7 @@ def main():
         print("Example: python src/context_aware_parser.py 'What are the citizenship requirements'")
         sys.exit(1)
 
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     query = ' '.join(sys.argv[1:])
 
     # Simulate selected programs from environment
@@ -5,22 +5,70 @@ In v3, attributes are rows and programs are columns (opposite of v2).
 """
 
 import sqlite3
-import csv
 import sys
 from pathlib import Path
 
+import pandas as pd
+
+try:
+    from .db_relations import drop_relation
+except ImportError:
+    # Run as a script (python src/create_v3_tables.py)
+    from db_relations import drop_relation
+
 # Database path
 DB_PATH = Path(__file__).parent.parent / "loanpilot.db"
 TSV_PATH = Path(__file__).parent.parent / "data" / "v3" / "Non-QM_Matrix.xlsx - Attributes.tsv"
 
+# programs_v3 columns by TSV header. The TSV also has two unnamed columns
+# (after LoanStream-Core NonQM and after LoanStream-DSCR 5-8 Unit) that are not loaded
+PROGRAMS_V3_COLUMNS = {
+    "Attribute Group": "attribute_group",
+    "Attribute Name": "attribute_name",
+    "Values": "values",
+    "Borrower Facing": "borrower_facing",
+    "PRMG/Prime Connect (verbatim from product matrix)": "prmg_prime_connect_verbatim",
+    "PRMG/Prime Connect": "prmg_prime_connect",
+    "PRMG/Plus Connect": "prmg_plus_connect",
+    "PRMG/Flex Connect Prime": "prmg_flex_connect_prime",
+    "PRMG/Flex Connect Plus": "prmg_flex_connect_plus",
+    "PRMG/Elite Connect  Prime": "prmg_elite_connect_prime",
+    "PRMG/Alternative AUS": "prmg_alternative_aus",
+    "PRMG/Choice Stretched": "prmg_choice_stretched",
+    "PRMG/Choice Non Prime": "prmg_choice_non_prime",
+    "Notes": "notes",
+    "For discussion (variable not consistent with definition)": "for_discussion",
+    "Alternate Name": "alternate_name",
+    "Attribute Generic Name": "attribute_generic_name",
+    "Description": "description",
+    "uom": "uom",
+    "LoanStream-Select NonQM": "loanstream_select_nonqm",
+    "LoanStream-Core NonQM": "loanstream_core_nonqm",
+    "LoanStream-Select DSCR": "loanstream_select_dscr",
+    "LoanStream-CoreDSCR": "loanstream_core_dscr",
+    "LoanStream-Sub1 DSCR": "loanstream_sub1_dscr",
+    "LoanStream-No Ratio DSCR": "loanstream_no_ratio_dscr",
+    "LoanStream-DSCR 5-8 Unit": "loanstream_dscr_5_8_unit",
+    "format status": "format_status",
+}
+
+def has_fts_index(conn):
+    """Check whether the programs_v3 full-text index exists"""
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'programs_v3_fts'"
+    ).fetchone()
+    return row is not None
+
 def create_v3_schema(conn):
     """Create v3 tables with transposed structure"""
     cursor = conn.cursor()
 
-    # Drop existing v3 tables if they exist
-    cursor.execute("DROP TABLE IF EXISTS programs_v3")
-    cursor.execute("DROP TABLE IF EXISTS prime_v3")
-    cursor.execute("DROP TABLE IF EXISTS loanstream_v3")
+    # Drop existing v3 tables/views if they exist (older databases stored
+    # prime_v3 and loanstream_v3 as tables)
+    drop_relation(cursor, "prime_v3")
+    drop_relation(cursor, "loanstream_v3")
+    drop_relation(cursor, "programs_v3_fts")
+    drop_relation(cursor, "programs_v3")
 
     # Create programs_v3 - unified table with all programs
     cursor.execute("""
@@ -55,53 +103,74 @@ def create_v3_schema(conn):
         )
     """)
 
-    # Create prime_v3 - PRMG programs only
+    # Equality lookups on attribute_name
+    cursor.execute("CREATE INDEX idx_programs_v3_attr_name ON programs_v3(attribute_name)")
+
+    # Full-text index over the attribute columns for keyword/prefix searches.
+    # It reads its content from programs_v3 and is rebuilt after each load.
+    try:
+        cursor.execute("""
+            CREATE VIRTUAL TABLE programs_v3_fts USING fts5(
+                attribute_group,
+                attribute_name,
+                "values",
+                borrower_facing,
+                content='programs_v3',
+                content_rowid='rowid'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"⚠️  Skipping programs_v3_fts (FTS5 unavailable): {e}")
+
+    # prime_v3 and loanstream_v3 are column subsets of programs_v3, so they are
+    # views rather than copies of the data
     cursor.execute("""
-        CREATE TABLE prime_v3 (
-            attribute_group TEXT,
-            attribute_name TEXT,
-            "values" TEXT,
-            borrower_facing TEXT,
-            prmg_prime_connect_verbatim TEXT,
-            prmg_prime_connect TEXT,
-            prmg_plus_connect TEXT,
-            prmg_flex_connect_prime TEXT,
-            prmg_flex_connect_plus TEXT,
-            prmg_elite_connect_prime TEXT,
-            prmg_alternative_aus TEXT,
-            prmg_choice_stretched TEXT,
-            prmg_choice_non_prime TEXT,
-            notes TEXT,
-            for_discussion TEXT,
-            alternate_name TEXT,
-            attribute_generic_name TEXT,
-            description TEXT,
-            uom TEXT
-        )
+        CREATE VIEW prime_v3 AS
+        SELECT
+            attribute_group,
+            attribute_name,
+            "values",
+            borrower_facing,
+            prmg_prime_connect_verbatim,
+            prmg_prime_connect,
+            prmg_plus_connect,
+            prmg_flex_connect_prime,
+            prmg_flex_connect_plus,
+            prmg_elite_connect_prime,
+            prmg_alternative_aus,
+            prmg_choice_stretched,
+            prmg_choice_non_prime,
+            notes,
+            for_discussion,
+            alternate_name,
+            attribute_generic_name,
+            description,
+            uom
+        FROM programs_v3
     """)
 
-    # Create loanstream_v3 - LoanStream programs only
     cursor.execute("""
-        CREATE TABLE loanstream_v3 (
-            attribute_group TEXT,
-            attribute_name TEXT,
-            "values" TEXT,
-            borrower_facing TEXT,
-            loanstream_select_nonqm TEXT,
-            loanstream_core_nonqm TEXT,
-            loanstream_select_dscr TEXT,
-            loanstream_core_dscr TEXT,
-            loanstream_sub1_dscr TEXT,
-            loanstream_no_ratio_dscr TEXT,
-            loanstream_dscr_5_8_unit TEXT,
-            notes TEXT,
-            for_discussion TEXT,
-            alternate_name TEXT,
-            attribute_generic_name TEXT,
-            description TEXT,
-            uom TEXT,
-            format_status TEXT
-        )
+        CREATE VIEW loanstream_v3 AS
+        SELECT
+            attribute_group,
+            attribute_name,
+            "values",
+            borrower_facing,
+            loanstream_select_nonqm,
+            loanstream_core_nonqm,
+            loanstream_select_dscr,
+            loanstream_core_dscr,
+            loanstream_sub1_dscr,
+            loanstream_no_ratio_dscr,
+            loanstream_dscr_5_8_unit,
+            notes,
+            for_discussion,
+            alternate_name,
+            attribute_generic_name,
+            description,
+            uom,
+            format_status
+        FROM programs_v3
     """)
 
     conn.commit()
@@ -115,124 +184,39 @@ def populate_v3_tables(conn):
         print(f"✗ TSV file not found: {TSV_PATH}")
         return False
 
-    with open(TSV_PATH, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f, delimiter='\t')
-        header = next(reader)  # Skip header row
-
-        row_count = 0
-        for row in reader:
-            # Ensure row has enough columns (pad with empty strings if needed)
-            while len(row) < 28:
-                row.append('')
-
-            # Extract columns
-            attribute_group = row[0].strip()
-            attribute_name = row[1].strip()
-            values = row[2].strip()
-            borrower_facing = row[3].strip()
-
-            # PRMG programs (columns 4-12)
-            prmg_prime_connect_verbatim = row[4].strip()
-            prmg_prime_connect = row[5].strip()
-            prmg_plus_connect = row[6].strip()
-            prmg_flex_connect_prime = row[7].strip()
-            prmg_flex_connect_plus = row[8].strip()
-            prmg_elite_connect_prime = row[9].strip()
-            prmg_alternative_aus = row[10].strip()
-            prmg_choice_stretched = row[11].strip()
-            prmg_choice_non_prime = row[12].strip()
-
-            # Documentation (columns 13-18)
-            notes = row[13].strip()
-            for_discussion = row[14].strip()
-            alternate_name = row[15].strip()
-            attribute_generic_name = row[16].strip()
-            description = row[17].strip()
-            uom = row[18].strip()
-
-            # LoanStream programs (columns 19-25)
-            loanstream_select_nonqm = row[19].strip()
-            loanstream_core_nonqm = row[20].strip()
-            # Column 21 is blank
-            loanstream_select_dscr = row[22].strip()
-            loanstream_core_dscr = row[23].strip()
-            loanstream_sub1_dscr = row[24].strip()
-            loanstream_no_ratio_dscr = row[25].strip()
-            loanstream_dscr_5_8_unit = row[26].strip()
-
-            # Format status (column 27)
-            format_status = row[27].strip() if len(row) > 27 else ''
-
-            # Insert into programs_v3 (unified table)
-            cursor.execute("""
-                INSERT INTO programs_v3 (
-                    attribute_group, attribute_name, "values", borrower_facing,
-                    prmg_prime_connect_verbatim, prmg_prime_connect, prmg_plus_connect,
-                    prmg_flex_connect_prime, prmg_flex_connect_plus, prmg_elite_connect_prime,
-                    prmg_alternative_aus, prmg_choice_stretched, prmg_choice_non_prime,
-                    notes, for_discussion, alternate_name, attribute_generic_name,
-                    description, uom,
-                    loanstream_select_nonqm, loanstream_core_nonqm,
-                    loanstream_select_dscr, loanstream_core_dscr, loanstream_sub1_dscr,
-                    loanstream_no_ratio_dscr, loanstream_dscr_5_8_unit,
-                    format_status
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                attribute_group, attribute_name, values, borrower_facing,
-                prmg_prime_connect_verbatim, prmg_prime_connect, prmg_plus_connect,
-                prmg_flex_connect_prime, prmg_flex_connect_plus, prmg_elite_connect_prime,
-                prmg_alternative_aus, prmg_choice_stretched, prmg_choice_non_prime,
-                notes, for_discussion, alternate_name, attribute_generic_name,
-                description, uom,
-                loanstream_select_nonqm, loanstream_core_nonqm,
-                loanstream_select_dscr, loanstream_core_dscr, loanstream_sub1_dscr,
-                loanstream_no_ratio_dscr, loanstream_dscr_5_8_unit,
-                format_status
-            ))
-
-            # Insert into prime_v3 (PRMG only)
-            cursor.execute("""
-                INSERT INTO prime_v3 (
-                    attribute_group, attribute_name, "values", borrower_facing,
-                    prmg_prime_connect_verbatim, prmg_prime_connect, prmg_plus_connect,
-                    prmg_flex_connect_prime, prmg_flex_connect_plus, prmg_elite_connect_prime,
-                    prmg_alternative_aus, prmg_choice_stretched, prmg_choice_non_prime,
-                    notes, for_discussion, alternate_name, attribute_generic_name,
-                    description, uom
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                attribute_group, attribute_name, values, borrower_facing,
-                prmg_prime_connect_verbatim, prmg_prime_connect, prmg_plus_connect,
-                prmg_flex_connect_prime, prmg_flex_connect_plus, prmg_elite_connect_prime,
-                prmg_alternative_aus, prmg_choice_stretched, prmg_choice_non_prime,
-                notes, for_discussion, alternate_name, attribute_generic_name,
-                description, uom
-            ))
-
-            # Insert into loanstream_v3 (LoanStream only)
-            cursor.execute("""
-                INSERT INTO loanstream_v3 (
-                    attribute_group, attribute_name, "values", borrower_facing,
-                    loanstream_select_nonqm, loanstream_core_nonqm,
-                    loanstream_select_dscr, loanstream_core_dscr, loanstream_sub1_dscr,
-                    loanstream_no_ratio_dscr, loanstream_dscr_5_8_unit,
-                    notes, for_discussion, alternate_name, attribute_generic_name,
-                    description, uom, format_status
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                attribute_group, attribute_name, values, borrower_facing,
-                loanstream_select_nonqm, loanstream_core_nonqm,
-                loanstream_select_dscr, loanstream_core_dscr, loanstream_sub1_dscr,
-                loanstream_no_ratio_dscr, loanstream_dscr_5_8_unit,
-                notes, for_discussion, alternate_name, attribute_generic_name,
-                description, uom, format_status
-            ))
-
-            row_count += 1
+    # The file mixes CR and CRLF line endings; pandas' C parser only tokenizes
+    # it reliably with blank-line skipping disabled
+    df = pd.read_csv(TSV_PATH, sep='\t', dtype=str, keep_default_na=False,
+                     skip_blank_lines=False, encoding='utf-8')
 
+    missing = [name for name in PROGRAMS_V3_COLUMNS if name not in df.columns]
+    if missing:
+        print(f"✗ TSV file is missing columns: {', '.join(missing)}")
+        return False
+
+    # Select and rename columns by header name
+    df = df[list(PROGRAMS_V3_COLUMNS)].rename(columns=PROGRAMS_V3_COLUMNS).fillna('')
+    for col in df.columns:
+        df[col] = df[col].str.strip()
+
+    # Tables were just dropped and recreated, so skip journaling for the bulk load
+    journal_mode = cursor.execute("PRAGMA journal_mode").fetchone()[0]
+    synchronous = cursor.execute("PRAGMA synchronous").fetchone()[0]
+    cursor.execute("PRAGMA journal_mode=OFF")
+    cursor.execute("PRAGMA synchronous=OFF")
+
+    try:
+        # Insert into programs_v3 (prime_v3 and loanstream_v3 are views over it)
+        df.to_sql('programs_v3', conn, if_exists='append', index=False, chunksize=1000)
+        if has_fts_index(conn):
+            cursor.execute("INSERT INTO programs_v3_fts(programs_v3_fts) VALUES('rebuild')")
         conn.commit()
-        print(f"✓ Populated v3 tables with {row_count} attributes")
-        return True
+    finally:
+        cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+
+    print(f"✓ Populated v3 tables with {len(df)} attributes")
+    return True
 
 def verify_v3_tables(conn):
     """Verify that v3 tables were created and populated correctly"""
@@ -258,7 +242,7 @@ def verify_v3_tables(conn):
         FROM programs_v3
         WHERE attribute_name IN ('borrower_credit_score', 'loan_amount', 'ltv', 'dti')
     """)
-    for row in cursor.fetchall():
+    for row in cursor:
         print(f"{row[0]}: PRMG={row[1][:50]}... | LoanStream={row[2][:50]}...")
 
 def main():
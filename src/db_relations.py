@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Helpers for SQLite relations that may be stored as either tables or views.
+Older databases stored prime_v3 and loanstream_v3 as tables; newer ones define
+them as views over programs_v3.
+"""
+
+from typing import Optional, Tuple
+
+
+def relation_type(cursor, name: str) -> Optional[str]:
+    """
+    Look up what kind of relation currently exists under name.
+
+    Returns:
+        'table', 'view', or None if there is neither
+    """
+    cursor.execute("SELECT type FROM sqlite_master WHERE name = ? AND type IN ('table', 'view')", (name,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def drop_relation(cursor, name: str, types: Tuple[str, ...] = ('table', 'view')) -> Optional[str]:
+    """
+    Drop the relation under name if it is one of the given types.
+
+    Args:
+        cursor: SQLite cursor
+        name: Table or view name
+        types: Relation types that may be dropped (e.g. ('view',) to keep tables)
+
+    Returns:
+        The type that was dropped, or None if nothing was dropped
+    """
+    kind = relation_type(cursor, name)
+    if kind not in types:
+        return None
+    cursor.execute(f"DROP {kind.upper()} {name}")
+    return kind
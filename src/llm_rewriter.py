@@ -6,22 +6,300 @@ Uses RAG (Retrieval-Augmented Generation) to map user queries to database parame
 """
 
 import os
+import re
 import time
 import json
+import hashlib
+import importlib.util
+import queue
 import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
 from typing import Optional, Dict, List, Tuple
-from datetime import datetime, timedelta
+from pathlib import Path
 from dotenv import load_dotenv
 
+try:
+    import simsimd
+except ImportError:  # Parameter scoring falls back to NumPy dot products
+    simsimd = None
+
 # Load environment variables from .env file
 load_dotenv()
 
+# Seconds of silence tolerated on a streamed response before giving up
+STREAM_IDLE_TIMEOUT = 15.0
+
+# Number of query embeddings kept in memory for repeated queries
+EMBEDDING_CACHE_SIZE = 1024
+
+# Queries rewritten locally (no API call) when the best RAG hit scores above
+# the threshold: plain "what is the X" / "find X" lookups with no program,
+# servicer or other qualifier that the template could not express
+RAG_SHORTCUT_THRESHOLD = 0.75
+_RAG_SHORTCUT_RE = re.compile(r'^\s*(?:what\s+(?:is|are)\s+the|find)\b', re.IGNORECASE)
+_QUALIFIER_RE = re.compile(r'\b(?:for|by|in|from|with|of)\b', re.IGNORECASE)
+_ACROSS_PROGRAMS_RE = re.compile(r'\bacross\s+(?:all\s+)?programs?\b', re.IGNORECASE)
+_PROGRAMS_RE = re.compile(r'\bprograms?\b', re.IGNORECASE)
+
+# Query rewriting prompt. The head (instructions, script list, examples) is
+# identical across queries and goes in the system block; only the tail
+# (parameter mappings and the query) changes per call. The head is marked for
+# prompt caching, but at a few hundred tokens plus the script list it is below
+# the API's minimum cacheable length (1024 tokens, 2048 on Haiku models), so
+# the marker only takes effect if the script list grows past that.
+_PROMPT_HEAD = """You are a query rewriter for a loan program database system.
+
+Your task: Rewrite the user's natural language query to match ONE of the available script patterns below. Output ONLY the rewritten query with no explanation.
+
+Available script patterns:
+{scripts}
+
+Guidelines:
+- Identify the user's intent (find parameter, show programs, match borrowers, etc.)
+- Extract key entities: parameter names, program names, servicer names
+- Match to the most appropriate script pattern
+- CRITICAL: Parameter name must come IMMEDIATELY after "Find" - use format "Find {{param_name}} across programs"
+- When user asks "What are the X" or "What is the X" where X looks like a parameter name, rewrite to "Find X across programs"
+- Use exact database column names (with underscores), following the term mappings given with each query
+
+Examples:
+User query: "What is the loan amount range allowed"
+Rewritten: Find loan_amount across programs
+
+User query: "What is the max dti limit?"
+Rewritten: Find dti across programs
+
+User query: "What are the conditions for allowing appraisal transfer?"
+Rewritten: Find appraisal_transfer_allowed across programs
+
+User query: "Tell me about credit score requirements across all programs"
+Rewritten: Find borrower_credit_score across programs
+
+User query: "Can you show me what PRMG/Prime Connect supports"
+Rewritten: Find all parameters for PRMG/Prime Connect"""
+
+_PROMPT_TAIL = """Term mappings:
+{params}
+
+Now rewrite this query:
+User query: {query}
+Rewritten:"""
+
+_DEFAULT_PARAM_SECTION = """- Map common terms to database column names:
+  * "appraisal transfer" → "appraisal_transfer_allowed"
+  * "appraisal review" → "appraisal_review_required"
+  * "credit score" → "borrower_credit_score"
+  * "loan amount" → "loan_amount"
+  * "DTI", "debt to income" → "dti"
+  * "LTV", "loan to value" → "ltv\""""
+
+# Concurrent query embeddings are coalesced into batches of up to this many,
+# waiting at most this many seconds for the rest of a burst
+EMBED_BATCH_SIZE = 32
+EMBED_BATCH_WINDOW = 0.05
+
+# Bounds for the embedding model's token window, which is sized from the
+# parameter corpus (transformer cost grows roughly with its square)
+MIN_SEQ_LENGTH = 32
+MAX_SEQ_LENGTH = 128
+
+# Exported ONNX models and parameter embeddings, reused across process restarts
+CACHE_DIR = Path(os.getenv('LOANPILOT_CACHE_DIR', str(Path.home() / '.cache' / 'loanpilot')))
+ONNX_CACHE_DIR = CACHE_DIR / 'onnx'
+
+
+# Queued by QueryEmbeddingBatcher.close() to end its worker thread
+_STOP_WORKER = object()
+
+
+def _quantize_i8(vectors):
+    """Scale L2-normalized float vectors (components in [-1, 1]) to int8."""
+    import numpy as np
+    return np.ascontiguousarray(np.clip(np.round(vectors * 127), -127, 127).astype(np.int8))
+
+
+class QueryEmbeddingBatcher:
+    """
+    Coalesces concurrent query embeddings into batched encode() calls.
+
+    A daemon thread takes the first pending query, then waits up to `window`
+    seconds for the other callers already in flight (at most `max_batch`).
+    A lone caller is encoded right away, without waiting for the window.
+    close() stops the thread, which otherwise keeps `encode` (and its owner)
+    alive.
+    """
+
+    def __init__(self, encode, max_batch: int = EMBED_BATCH_SIZE,
+                 window: float = EMBED_BATCH_WINDOW):
+        """
+        Args:
+            encode: Callable mapping a list of queries to a 2-D embedding array
+            max_batch: Maximum number of queries per encode() call
+            window: Maximum seconds to wait for the rest of a burst
+        """
+        self._encode = encode
+        self.max_batch = max_batch
+        self.window = window
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._worker: Optional[threading.Thread] = None
+
+    def embed(self, query: str):
+        """
+        Embed one query, batched with any concurrent callers.
+
+        Args:
+            query: Query text
+
+        Returns:
+            The query's row of the batch embedding array
+        """
+        future = Future()
+        with self._lock:
+            self._in_flight += 1
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, args=(self._queue,),
+                    name='query-embedding-batcher', daemon=True
+                )
+                self._worker.start()
+            self._queue.put((query, future))
+        return future.result()
+
+    def close(self):
+        """
+        Stop the worker thread once it has encoded the queries already queued.
+
+        A later embed() starts a new worker on a fresh queue.
+        """
+        with self._lock:
+            if self._worker is None:
+                return
+            self._queue.put(_STOP_WORKER)
+            self._queue = queue.Queue()
+            self._worker = None
+
+    def _run(self, requests: queue.Queue):
+        """Worker loop: collect a batch, encode it, hand back the rows."""
+        stopping = False
+        while not stopping:
+            item = requests.get()
+            if item is _STOP_WORKER:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < min(self.max_batch, self._in_flight):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP_WORKER:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            try:
+                embeddings = self._encode([query for query, _ in batch])
+                error = None
+            except Exception as e:
+                error = e
+
+            with self._lock:
+                self._in_flight -= len(batch)
+            for i, (_, future) in enumerate(batch):
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(embeddings[i])
+
+
+class OnnxSentenceEncoder:
+    """
+    Sentence embedder running a transformer encoder on ONNX Runtime.
+
+    Mirrors the parts of the SentenceTransformer API used here (encode,
+    tokenizer, max_seq_length) with mean pooling, as used by the
+    sentence-transformers MiniLM/mpnet models.
+    """
+
+    def __init__(self, model_name: str, export_dir: Path):
+        """
+        Load the ONNX export of a model, exporting it on first use.
+
+        Args:
+            model_name: Hugging Face model name
+            export_dir: Directory holding (or receiving) the ONNX export
+        """
+        import onnxruntime as ort
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        session_options = ort.SessionOptions()
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session_options.intra_op_num_threads = os.cpu_count() or 1
+
+        exported = (export_dir / 'model.onnx').exists()
+        source = str(export_dir) if exported else model_name
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            source, export=not exported, session_options=session_options,
+            provider='CPUExecutionProvider'
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(source)
+        if not exported:
+            self.model.save_pretrained(export_dir)
+            self.tokenizer.save_pretrained(export_dir)
+
+        self.max_seq_length = MAX_SEQ_LENGTH
+
+    def encode(self, sentences, normalize_embeddings: bool = False, batch_size: int = 32,
+               show_progress_bar: bool = False):
+        """
+        Embed one sentence or a list of sentences.
+
+        Args:
+            sentences: A string or list of strings
+            normalize_embeddings: Scale each embedding to unit length
+            batch_size: Sentences per forward pass
+            show_progress_bar: Accepted for SentenceTransformer compatibility
+
+        Returns:
+            float32 numpy array, 1-D for a single string and 2-D otherwise
+        """
+        import numpy as np
+
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            inputs = self.tokenizer(
+                sentences[start:start + batch_size], padding=True, truncation=True,
+                max_length=self.max_seq_length, return_tensors='np'
+            )
+            hidden = np.asarray(self.model(**inputs).last_hidden_state, dtype=np.float32)
+            # Mean pooling over real (non-padding) tokens
+            mask = inputs['attention_mask'][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            batches.append(pooled)
+
+        embeddings = np.concatenate(batches) if batches else np.empty((0, 0), dtype=np.float32)
+        if normalize_embeddings and len(embeddings):
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings[0] if single else embeddings
+
 
 class LLMRewriter:
     """Rewrites natural language queries using Anthropic Claude with RAG for parameter matching."""
 
     def __init__(self, model_name: str = "claude-3-5-haiku-20241022", cache_size: int = 1000,
-                 embedding_model: str = "sentence-transformers/all-mpnet-base-v2"):
+                 embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2"):
         """
         Initialize the LLM rewriter with parameter RAG.
 
@@ -33,23 +311,67 @@ class LLMRewriter:
         self.model_name = model_name
         self.api_key = os.getenv('ANTHROPIC_API_KEY')
         self.client = None
-        self.cache: Dict[str, tuple] = {}  # {query: (rewritten, timestamp)}
+        self.cache: OrderedDict = OrderedDict()  # {query: (rewritten, timestamp)}, LRU order
         self.cache_size = cache_size
-        self.cache_ttl = timedelta(hours=1)
+        self.cache_ttl_seconds = 3600.0  # compared against time.monotonic()
+
+        # Script prompts rarely change; cache the list and its prompt section
+        self._scripts_cache: Optional[List[str]] = None
+        self._scripts_cache_time: Optional[float] = None
+        self._system_prompt_cache: Optional[Tuple[Tuple[str, ...], List[Dict]]] = None  # (scripts, blocks)
         self.anthropic_available = False
         self.load_error = None
 
+        # Long-lived database connection, opened on first use
+        self.db_path = os.environ.get('DB_PATH', 'loanpilot.db')
+        self._db_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
         # Parameter RAG components
         self.embedding_model_name = embedding_model
         self.embedding_model = None
+        self.embedding_backend: Optional[str] = None  # e.g. 'onnx-fp32', set when the model loads
+        self.embedding_seq_length = MAX_SEQ_LENGTH
         self.param_embeddings = None
+        self._param_texts: List[str] = []
+        self._corpus_backend: Optional[str] = None  # backend that encoded param_embeddings
+        self.param_embeddings_i8 = None
         self.param_metadata = None
         self.rag_available = False
+        self.embedding_cache: OrderedDict = OrderedDict()  # {query: float32 unit vector}
+        self.embedding_cache_size = EMBEDDING_CACHE_SIZE
+        self._embedding_cache_lock = threading.Lock()
+        self._embed_batcher = QueryEmbeddingBatcher(self._encode_queries)
 
         # Initialize Anthropic client and RAG
         self._init_client()
         self._init_parameter_rag()
 
+    def _get_connection(self) -> sqlite3.Connection:
+        """Return the rewriter's database connection, opening it on first use."""
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA cache_size=-20000")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            if os.environ.get('LOANPILOT_SQLITE_WAL') == '1':
+                # Opt-in, see ContextAwareParser._open_connection
+                try:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                except sqlite3.Error as e:
+                    # Read-only databases keep their existing journal mode
+                    print(f"⚠ Could not enable WAL mode: {e}")
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        """Stop the query embedding worker and close the database connection."""
+        self._embed_batcher.close()
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
     def _init_client(self) -> bool:
         """
         Initialize Anthropic client.
@@ -93,28 +415,21 @@ class LLMRewriter:
             return True
 
         try:
-            # Import sentence transformers
-            from sentence_transformers import SentenceTransformer, util
-            import torch
-
-            # Load embedding model
-            self.embedding_model = SentenceTransformer(self.embedding_model_name)
+            import numpy as np
 
             # Load parameter metadata from database
-            db_path = os.environ.get('DB_PATH', 'loanpilot.db')
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT column_name, attribute_group, display_name, possible_values,
-                       borrower_facing, common_terms, description
-                FROM parameter_metadata
-                ORDER BY column_name
-            ''')
+            with self._db_lock:
+                rows = self._get_connection().execute('''
+                    SELECT column_name, attribute_group, display_name, possible_values,
+                           borrower_facing, common_terms, description
+                    FROM parameter_metadata
+                    ORDER BY column_name
+                ''').fetchall()
 
             self.param_metadata = []
             param_texts = []
 
-            for row in cursor.fetchall():
+            for row in rows:
                 column_name, attribute_group, display_name, possible_values, borrower_facing, common_terms_json, description = row
                 common_terms = json.loads(common_terms_json)
 
@@ -140,14 +455,21 @@ class LLMRewriter:
                     'description': description
                 })
 
-            conn.close()
-
             if not param_texts:
                 print("⚠ No parameters found in parameter_metadata table")
                 return False
 
-            # Generate embeddings for all parameters
-            self.param_embeddings = self.embedding_model.encode(param_texts, convert_to_tensor=True)
+            # Embeddings depend on the model, its backend and the texts, so reuse
+            # the ones saved by an earlier run; the model then loads on first query
+            self._param_texts = param_texts
+            backend = self._expected_embedding_backend()
+            embeddings_path = self._embeddings_path(backend, param_texts)
+            if embeddings_path.exists():
+                self._set_param_embeddings(np.load(embeddings_path, mmap_mode='r'), backend)
+                self.embedding_seq_length = self._load_seq_length(embeddings_path)
+                print(f"✓ Loaded cached parameter embeddings from {embeddings_path}")
+            else:
+                self._encode_corpus()
             self.rag_available = True
 
             print(f"✓ Parameter RAG initialized with {len(self.param_metadata)} parameters")
@@ -158,6 +480,212 @@ class LLMRewriter:
             print("Will fall back to manual parameter mappings")
             return False
 
+    def _expected_embedding_backend(self) -> str:
+        """
+        Backend _load_embedding_model is expected to pick, without loading it.
+
+        Returns:
+            'onnx-fp32' when onnxruntime and optimum are installed, otherwise
+            'torch-fp16' on CUDA or 'torch-qint8' on CPU
+        """
+        if importlib.util.find_spec('onnxruntime') and importlib.util.find_spec('optimum'):
+            return 'onnx-fp32'
+        import torch
+        return 'torch-fp16' if torch.cuda.is_available() else 'torch-qint8'
+
+    def _embeddings_path(self, backend: str, param_texts: List[str]) -> Path:
+        """Cache file for the parameter embeddings of one model, backend and corpus."""
+        signature = hashlib.sha1(
+            "\n".join([self.embedding_model_name, backend] + param_texts).encode('utf-8')
+        ).hexdigest()
+        return CACHE_DIR / f"params_{signature}.npy"
+
+    def _set_param_embeddings(self, embeddings, backend: str):
+        """Install the parameter embeddings encoded by `backend`."""
+        self.param_embeddings = embeddings
+        self._corpus_backend = backend
+        # int8 copy for SimSIMD: 4x fewer bytes, and only the ranking matters
+        if simsimd is not None:
+            self.param_embeddings_i8 = _quantize_i8(embeddings)
+
+    def _encode_corpus(self):
+        """Encode the parameter texts with the loaded model and cache them under its backend."""
+        embeddings = self._encode_parameters(self._param_texts)
+        self._set_param_embeddings(embeddings, self.embedding_backend)
+        self._save_embeddings(
+            self._embeddings_path(self.embedding_backend, self._param_texts),
+            embeddings, self.embedding_seq_length
+        )
+
+    def _embed_query(self, query: str):
+        """
+        Embed a query, reusing the cached vector for repeated queries.
+
+        Args:
+            query: User's natural language query
+
+        Returns:
+            Read-only, L2-normalized float32 numpy vector
+        """
+        with self._embedding_cache_lock:
+            embedding = self.embedding_cache.get(query)
+            if embedding is not None:
+                self.embedding_cache.move_to_end(query)
+                return embedding
+
+        # Concurrent misses are encoded together in one batch
+        embedding = self._embed_batcher.embed(query)
+        embedding.flags.writeable = False
+
+        with self._embedding_cache_lock:
+            if query not in self.embedding_cache and len(self.embedding_cache) >= self.embedding_cache_size:
+                self.embedding_cache.popitem(last=False)
+            self.embedding_cache[query] = embedding
+        return embedding
+
+    def _encode_queries(self, queries: List[str]):
+        """
+        Encode a batch of queries.
+
+        Args:
+            queries: Query texts
+
+        Returns:
+            Contiguous float32 matrix of unit-length embeddings, one row per query
+        """
+        import numpy as np
+
+        return np.ascontiguousarray(
+            self._get_embedding_model().encode(
+                queries, normalize_embeddings=True, batch_size=EMBED_BATCH_SIZE,
+                show_progress_bar=False
+            ),
+            dtype=np.float32
+        )
+
+    def _encode_parameters(self, param_texts: List[str]):
+        """
+        Encode the parameter corpus, loading the embedding model if needed.
+
+        Args:
+            param_texts: One descriptive text per parameter
+
+        Returns:
+            Contiguous float32 matrix of unit-length embeddings, one row per text
+        """
+        import numpy as np
+
+        model = self._get_embedding_model()
+
+        # Shrink the token window to the 95th percentile of the parameter
+        # texts (special tokens included); the long tail is truncated.
+        token_lengths = [len(model.tokenizer.encode(text)) for text in param_texts]
+        self.embedding_seq_length = int(np.clip(
+            np.percentile(token_lengths, 95), MIN_SEQ_LENGTH, MAX_SEQ_LENGTH
+        ))
+        model.max_seq_length = self.embedding_seq_length
+
+        # Unit-length embeddings, so cosine similarity against a normalized
+        # query is a plain dot product (SimSIMD/NumPy scoring)
+        return np.ascontiguousarray(
+            model.encode(
+                param_texts, normalize_embeddings=True, batch_size=128,
+                show_progress_bar=False
+            ),
+            dtype=np.float32
+        )
+
+    @staticmethod
+    def _save_embeddings(path: Path, embeddings, max_seq_length: int):
+        """
+        Atomically save parameter embeddings for later runs.
+
+        Args:
+            path: Destination .npy file
+            embeddings: Embedding matrix to save
+            max_seq_length: Token window the embeddings were encoded with,
+                saved alongside so queries are encoded with the same window
+        """
+        import numpy as np
+
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Sidecar first: the .npy appearing is what marks the cache complete
+            path.with_suffix('.json').write_text(json.dumps({'max_seq_length': max_seq_length}))
+            with open(tmp_path, 'wb') as f:
+                np.save(f, embeddings)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠ Could not cache parameter embeddings: {e}")
+            tmp_path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _load_seq_length(path: Path) -> int:
+        """Token window saved with cached embeddings (MAX_SEQ_LENGTH if unknown)."""
+        try:
+            return int(json.loads(path.with_suffix('.json').read_text())['max_seq_length'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return MAX_SEQ_LENGTH
+
+    def _get_embedding_model(self):
+        """Return the embedding model, loading it on first use."""
+        if self.embedding_model is None:
+            try:
+                self.embedding_model = self._load_embedding_model()
+            except Exception:
+                # Without a model, queries cannot be embedded; stop retrying
+                self.rag_available = False
+                raise
+
+            # Cached embeddings were keyed on the expected backend; if the load
+            # fell back to another one, its vectors are not comparable
+            if self._corpus_backend is not None and self._corpus_backend != self.embedding_backend:
+                print(f"⚠ Cached embeddings came from {self._corpus_backend}, "
+                      f"re-encoding parameters with {self.embedding_backend}")
+                self._encode_corpus()
+        return self.embedding_model
+
+    def _load_embedding_model(self):
+        """
+        Load the embedding model, preferring ONNX Runtime over PyTorch.
+
+        Records the backend and precision in embedding_backend, and applies the
+        token window the parameter embeddings were encoded with.
+
+        Returns:
+            An OnnxSentenceEncoder, or a SentenceTransformer when optimum /
+            onnxruntime are not installed or the export fails
+        """
+        try:
+            export_dir = ONNX_CACHE_DIR / self.embedding_model_name.replace('/', '--')
+            model = OnnxSentenceEncoder(self.embedding_model_name, export_dir)
+            model.max_seq_length = self.embedding_seq_length
+            self.embedding_backend = 'onnx-fp32'
+            print("✓ Embedding model running on ONNX Runtime")
+            return model
+        except Exception as e:
+            print(f"⚠ ONNX Runtime unavailable, using PyTorch embeddings: {e}")
+
+        from sentence_transformers import SentenceTransformer
+        import torch
+
+        model = SentenceTransformer(self.embedding_model_name)
+        model.max_seq_length = self.embedding_seq_length
+        if model.device.type == 'cuda':
+            model.half()
+            self.embedding_backend = 'torch-fp16'
+        else:
+            try:
+                model = torch.quantization.quantize_dynamic(
+                    model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+                self.embedding_backend = 'torch-qint8'
+            except Exception as e:
+                print(f"⚠ Int8 quantization unavailable, using float32 embeddings: {e}")
+                self.embedding_backend = 'torch-fp32'
+        return model
+
     def retrieve_relevant_parameters(self, query: str, top_k: int = 8) -> List[Dict]:
         """
         Retrieve most relevant parameters for a user query using semantic search.
@@ -169,27 +697,45 @@ class LLMRewriter:
         Returns:
             List of parameter metadata dictionaries
         """
-        if not self.rag_available or self.embedding_model is None or self.param_embeddings is None:
+        if not self.rag_available or self.param_embeddings is None:
             return []
 
         try:
-            from sentence_transformers import util
-
-            # Embed the query
-            query_embedding = self.embedding_model.encode(query, convert_to_tensor=True)
-
-            # Calculate cosine similarities
-            similarities = util.cos_sim(query_embedding, self.param_embeddings)[0]
-
-            # Get top-k indices
+            import numpy as np
+
+            # Embed the query (cached for repeated queries)
+            query_embedding = self._embed_query(query)
+
+            # Cosine similarities (both sides are already L2-normalized)
+            similarities = None
+            if self.param_embeddings_i8 is not None:
+                try:
+                    distances = simsimd.cdist(
+                        _quantize_i8(query_embedding)[None, :], self.param_embeddings_i8,
+                        metric="cosine"
+                    )
+                    similarities = 1.0 - np.asarray(distances, dtype=np.float32)[0]
+                except (TypeError, ValueError):
+                    # No int8 kernel on this CPU/build; use the float32 path
+                    self.param_embeddings_i8 = None
+            if similarities is None:
+                similarities = self.param_embeddings @ query_embedding
+
+            # Get top-k indices, best first: an O(N) partition, then sort only k
             k = min(top_k, len(self.param_metadata))
-            top_results = similarities.topk(k=k)
+            if k <= 0:
+                return []
+            if k < len(similarities):
+                top_indices = np.argpartition(similarities, -k)[-k:]
+            else:
+                top_indices = np.arange(len(similarities))
+            top_indices = top_indices[np.argsort(-similarities[top_indices], kind='stable')]
 
             # Return parameter metadata sorted by relevance
             relevant_params = []
-            for idx, score in zip(top_results.indices.tolist(), top_results.values.tolist()):
+            for idx in top_indices.tolist():
                 param = self.param_metadata[idx].copy()
-                param['relevance_score'] = float(score)
+                param['relevance_score'] = float(similarities[idx])
                 relevant_params.append(param)
 
             return relevant_params
@@ -212,7 +758,8 @@ class LLMRewriter:
         """
         if query in self.cache:
             rewritten, timestamp = self.cache[query]
-            if datetime.now() - timestamp < self.cache_ttl:
+            if time.monotonic() - timestamp < self.cache_ttl_seconds:
+                self.cache.move_to_end(query)
                 return rewritten
             else:
                 # Expired, remove from cache
@@ -227,28 +774,46 @@ class LLMRewriter:
             query: Original query
             rewritten: Rewritten query
         """
-        # Implement simple LRU: if cache full, remove oldest entry
-        if len(self.cache) >= self.cache_size:
-            oldest_key = min(self.cache.keys(), key=lambda k: self.cache[k][1])
-            del self.cache[oldest_key]
+        # LRU: if cache full, evict the least recently used entry
+        if query in self.cache:
+            self.cache.move_to_end(query)
+        elif len(self.cache) >= self.cache_size:
+            self.cache.popitem(last=False)
 
-        self.cache[query] = (rewritten, datetime.now())
+        self.cache[query] = (rewritten, time.monotonic())
 
-    def _build_prompt(self, query: str, available_scripts: List[str],
-                      relevant_params: Optional[List[Dict]] = None) -> str:
+    def _build_system_prompt(self, available_scripts: List[str]) -> List[Dict]:
         """
-        Build prompt for Claude to rewrite query with RAG-retrieved parameters.
+        Build the static system prompt for a script list (memoized).
 
         Args:
-            query: User's natural language query
             available_scripts: List of available script prompts
-            relevant_params: RAG-retrieved relevant parameters (optional)
 
         Returns:
-            Formatted prompt for Claude
+            System content blocks, marked for Anthropic prompt caching (a no-op
+            while the prompt is under the minimum cacheable length)
+        """
+        scripts_key = tuple(available_scripts)
+        if self._system_prompt_cache is None or self._system_prompt_cache[0] != scripts_key:
+            scripts_list = "\n".join([f"- {s}" for s in scripts_key])
+            self._system_prompt_cache = (scripts_key, [{
+                "type": "text",
+                "text": _PROMPT_HEAD.format(scripts=scripts_list),
+                "cache_control": {"type": "ephemeral"}
+            }])
+        return self._system_prompt_cache[1]
+
+    def _build_prompt(self, query: str, relevant_params: Optional[List[Dict]] = None) -> str:
         """
-        scripts_list = "\n".join([f"- {s}" for s in available_scripts])
+        Build the per-query part of the prompt with RAG-retrieved parameters.
 
+        Args:
+            query: User's natural language query
+            relevant_params: RAG-retrieved relevant parameters (optional)
+
+        Returns:
+            User message for Claude; the static instructions are in the system prompt
+        """
         # Build parameter mappings section using RAG if available
         if relevant_params is not None and len(relevant_params) > 0:
             param_mappings = []
@@ -261,51 +826,35 @@ class LLMRewriter:
             param_section = "- Map these common terms to the correct database column names:\n" + "\n".join(param_mappings)
         else:
             # Fallback to manual mappings if RAG not available
-            param_section = """- Map common terms to database column names:
-  * "appraisal transfer" → "appraisal_transfer_allowed"
-  * "appraisal review" → "appraisal_review_required"
-  * "credit score" → "borrower_credit_score"
-  * "loan amount" → "loan_amount"
-  * "DTI", "debt to income" → "dti"
-  * "LTV", "loan to value" → "ltv"""
-
-        prompt = f"""You are a query rewriter for a loan program database system.
-
-Your task: Rewrite the user's natural language query to match ONE of the available script patterns below. Output ONLY the rewritten query with no explanation.
-
-Available script patterns:
-{scripts_list}
-
-Guidelines:
-- Identify the user's intent (find parameter, show programs, match borrowers, etc.)
-- Extract key entities: parameter names, program names, servicer names
-- Match to the most appropriate script pattern
-- CRITICAL: Parameter name must come IMMEDIATELY after "Find" - use format "Find {{param_name}} across programs"
-- When user asks "What are the X" or "What is the X" where X looks like a parameter name, rewrite to "Find X across programs"
-- Use exact database column names (with underscores)
-{param_section}
-
-Examples:
-User query: "What is the loan amount range allowed"
-Rewritten: Find loan_amount across programs
-
-User query: "What is the max dti limit?"
-Rewritten: Find dti across programs
+            param_section = _DEFAULT_PARAM_SECTION
 
-User query: "What are the conditions for allowing appraisal transfer?"
-Rewritten: Find appraisal_transfer_allowed across programs
+        return _PROMPT_TAIL.format(params=param_section, query=query)
 
-User query: "Tell me about credit score requirements across all programs"
-Rewritten: Find borrower_credit_score across programs
-
-User query: "Can you show me what PRMG/Prime Connect supports"
-Rewritten: Find all parameters for PRMG/Prime Connect
+    @staticmethod
+    def _rewrite_from_rag(query: str, relevant_params: Optional[List[Dict]]) -> Optional[str]:
+        """
+        Rewrite a simple parameter lookup locally from the top RAG hit.
 
-Now rewrite this query:
-User query: {query}
-Rewritten:"""
+        Args:
+            query: User's natural language query
+            relevant_params: RAG-retrieved parameters, best first
 
-        return prompt
+        Returns:
+            "Find <column> across programs", or None if the query needs Claude
+        """
+        if not relevant_params or relevant_params[0]['relevance_score'] <= RAG_SHORTCUT_THRESHOLD:
+            return None
+        if not _RAG_SHORTCUT_RE.match(query):
+            return None
+        # Numbers ("620 credit score", "80 LTV") describe a borrower profile for match_programs
+        if any(ch.isdigit() for ch in query):
+            return None
+        # "across programs" is what the template says anyway; other qualifiers are not,
+        # and a query asking for programs ("find programs that allow ...") is a match
+        remainder = _ACROSS_PROGRAMS_RE.sub('', query)
+        if _QUALIFIER_RE.search(remainder) or _PROGRAMS_RE.search(remainder):
+            return None
+        return f"Find {relevant_params[0]['column_name']} across programs"
 
     def rewrite_query(self, query: str, available_scripts: List[str]) -> Optional[str]:
         """
@@ -324,10 +873,6 @@ Rewritten:"""
             print(f"💾 Using cached rewrite: '{query}' → '{cached}'")
             return cached
 
-        # Check Anthropic availability
-        if not self._init_client():
-            return None  # Fall back to semantic matching
-
         try:
             # Retrieve relevant parameters using RAG
             relevant_params = None
@@ -337,31 +882,40 @@ Rewritten:"""
                     param_names = ', '.join([p['column_name'] for p in relevant_params[:3]])
                     print(f"🔍 Retrieved {len(relevant_params)} relevant parameters: {param_names}...")
 
+            # A confident RAG hit on a plain lookup needs no model call
+            rewritten = self._rewrite_from_rag(query, relevant_params)
+            if rewritten:
+                print(f"⚡ RAG rewrite: '{query}' → '{rewritten}'")
+                self._update_cache(query, rewritten)
+                return rewritten
+
+            # Check Anthropic availability
+            if not self._init_client():
+                return None  # Fall back to semantic matching
+
             # Build prompt with RAG-retrieved parameters
-            prompt = self._build_prompt(query, available_scripts, relevant_params)
+            system_prompt = self._build_system_prompt(available_scripts)
+            prompt = self._build_prompt(query, relevant_params)
 
-            # Call Anthropic API
+            # Call Anthropic API, streaming the reply; the request timeout bounds
+            # each read, so a stalled generation fails fast instead of hanging
             start_time = time.time()
-            message = self.client.messages.create(
+            with self.client.messages.stream(
                 model=self.model_name,
                 max_tokens=100,  # Short response expected
                 temperature=0.3,  # Low temperature for consistency
+                system=system_prompt,
                 messages=[
                     {
                         "role": "user",
                         "content": prompt
                     }
-                ]
-            )
+                ],
+                timeout=STREAM_IDLE_TIMEOUT
+            ) as stream:
+                rewritten = "".join(stream.text_stream).strip()
             elapsed = time.time() - start_time
 
-            # Extract response
-            if not message.content or len(message.content) == 0:
-                print("⚠ Claude returned empty response")
-                return None
-
-            rewritten = message.content[0].text.strip()
-
             if not rewritten:
                 print("⚠ Could not extract query from Claude response")
                 return None
@@ -384,19 +938,24 @@ Rewritten:"""
         """
         Get list of available script prompts from database.
         This is a helper method to fetch script prompts for prompt building.
+        The list is cached for cache_ttl_seconds; call reset_scripts_cache() after
+        changing the scripts table.
 
         Returns:
             List of script prompt strings
         """
-        import sqlite3
+        if (self._scripts_cache is not None
+                and time.monotonic() - self._scripts_cache_time < self.cache_ttl_seconds):
+            return self._scripts_cache
 
         try:
-            db_path = os.environ.get('DB_PATH', 'loanpilot.db')
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT prompt FROM scripts ORDER BY name")
-            scripts = [row[0] for row in cursor.fetchall()]
-            conn.close()
+            with self._db_lock:
+                rows = self._get_connection().execute(
+                    "SELECT prompt FROM scripts ORDER BY name"
+                ).fetchall()
+            scripts = [row[0] for row in rows]
+            self._scripts_cache = scripts
+            self._scripts_cache_time = time.monotonic()
             return scripts
         except Exception as e:
             print(f"⚠ Error fetching scripts: {e}")
@@ -408,3 +967,9 @@ Rewritten:"""
                 "Show all parameters supported by program",
                 "Show programs for loan servicer"
             ]
+
+    def reset_scripts_cache(self):
+        """Drop the cached script list so the next call re-reads the database."""
+        self._scripts_cache = None
+        self._scripts_cache_time = None
+        self._system_prompt_cache = None
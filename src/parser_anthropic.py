@@ -8,9 +8,51 @@ import sqlite3
 import re
 import os
 import json
+import threading
 from typing import Tuple, Optional, Dict, List
 from anthropic import Anthropic
 
+try:
+    from .query_context import QUERY_CONTEXT
+except ImportError:
+    # Run as a script (python src/parser_anthropic.py)
+    from query_context import QUERY_CONTEXT
+
+# Seconds of silence tolerated on a streamed response before giving up
+STREAM_IDLE_TIMEOUT = 15.0
+
+# Query extraction patterns, compiled once at import time
+_ACROSS_PROGRAMS_RE = re.compile(r'\bacross\s+programs?\b', re.IGNORECASE)
+_PROGRAM_NAME_PATTERNS = tuple(re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'by\s+([A-Za-z0-9/\s\-]+?)\s+(?:in|from)',
+    r'for\s+([A-Za-z0-9/\s\-]+?)\s+(?:in|from)',
+    r'for\s+([A-Za-z0-9/\s\-]+?)$',
+    r'by\s+([A-Za-z0-9/\s\-]+?)$',
+    r'((?:PRMG/|LoanStream)[A-Za-z0-9/\s\-]+?)\s+program'
+))
+_PARAM_NAME_RE = re.compile(r'(\w+)\s+parameter', re.IGNORECASE)
+_FIND_PARAM_RE = re.compile(r'(?:find|show)\s+(\w+)\s+(?:across|for)', re.IGNORECASE)
+
+# All borrower parameters in one alternation, so a query is scanned once.
+# Each alternative has exactly one named group; match.lastgroup says which hit.
+_BORROWER_RE = re.compile(
+    r'(?P<credit_score>\d{3})\s*credit\s*score'
+    r'|\$?(?P<loan_amount>[\d,]+)\s*loan\s*amount'
+    r'|(?P<ltv>\d+(?:\.\d+)?)\s*%?\s*LTV'
+    r'|(?P<dti>\d+(?:\.\d+)?)\s*%?\s*DTI'
+    r'|\b(?P<purchase>purchase)\b'
+    r'|\b(?P<cash_out>cash\s*out)\b'
+    r'|\b(?P<rate_term>rate\s*(?:and|&)?\s*term)\b'
+    r'|\b(?P<owner_occupied>owner\s*occupied)\b'
+    r'|\b(?P<second_home>second\s*home)\b'
+    r'|\b(?P<investment>investment)\b',
+    re.IGNORECASE
+)
+# Keyword groups in priority order (first present wins, wherever it appears)
+_TRANSACTION_TYPES = (('purchase', 'Purchase'), ('cash_out', 'Cash Out'), ('rate_term', 'Rate & Term'))
+_OCCUPANCY_TYPES = (('owner_occupied', 'Owner Occupied'), ('second_home', 'Second Home'),
+                    ('investment', 'Investment'))
+
 class QueryParser:
     """Parse and execute user queries using Anthropic API for matching."""
 
@@ -25,6 +67,11 @@ class QueryParser:
         self.db_path = os.environ.get('DB_PATH', db_path)
         self.scratchpad_path = os.environ.get('SCRATCHPAD_PATH', '.scratchpad')
         self.script_cache = None
+        self._script_keyword_sets = None  # lowercase prompt tokens, per cached script
+
+        # Long-lived database connection shared by all lookups
+        self._db_lock = threading.Lock()
+        self._conn = self._open_connection()
 
         # Initialize Anthropic client
         self.use_llm = use_llm
@@ -41,26 +88,40 @@ class QueryParser:
             else:
                 print("⚠ ANTHROPIC_API_KEY not found in environment")
 
+    def _open_connection(self) -> sqlite3.Connection:
+        """Open the parser's long-lived database connection."""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA cache_size=-20000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        if os.environ.get('LOANPILOT_SQLITE_WAL') == '1':
+            # Opt-in, see ContextAwareParser._open_connection
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+            except sqlite3.Error as e:
+                # Read-only databases keep their existing journal mode
+                print(f"⚠ Could not enable WAL mode: {e}")
+        return conn
+
+    def close(self):
+        """Close the parser's database connection."""
+        with self._db_lock:
+            self._conn.close()
+
     def load_scripts(self) -> list:
         """Load all scripts from database."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            SELECT name, description, prompt, script
-            FROM scripts
-            ORDER BY name
-        """)
-
-        scripts = cursor.fetchall()
-        conn.close()
-
-        return scripts
+        with self._db_lock:
+            return self._conn.execute("""
+                SELECT name, description, prompt, script
+                FROM scripts
+                ORDER BY name
+            """).fetchall()
 
     def get_scripts(self):
         """Get cached scripts or load from database."""
         if self.script_cache is None:
             self.script_cache = self.load_scripts()
+            self._script_keyword_sets = [frozenset(script[2].lower().split()) for script in self.script_cache]
         return self.script_cache
 
     def match_query_with_anthropic(self, query: str) -> Optional[Tuple[str, str, float]]:
@@ -96,14 +157,16 @@ Respond with ONLY the number of the best matching script (1-{len(scripts)}). If
 Your response must be a single number only."""
 
         try:
-            message = self.anthropic.messages.create(
+            # Stream the reply; the request timeout bounds each read, so a
+            # stalled generation fails fast instead of hanging the caller
+            with self.anthropic.messages.stream(
                 model="claude-3-5-haiku-20241022",
                 max_tokens=10,
                 temperature=0,
-                messages=[{"role": "user", "content": prompt}]
-            )
-
-            response_text = message.content[0].text.strip()
+                messages=[{"role": "user", "content": prompt}],
+                timeout=STREAM_IDLE_TIMEOUT
+            ) as stream:
+                response_text = "".join(stream.text_stream).strip()
             match_idx = int(response_text) - 1
 
             if match_idx < 0 or match_idx >= len(scripts):
@@ -137,27 +200,22 @@ Your response must be a single number only."""
     def match_query_simple(self, query: str) -> Optional[Tuple[str, str, float]]:
         """Simple keyword-based fallback matching."""
         scripts = self.get_scripts()
-        query_lower = query.lower()
-
-        best_match = None
-        best_score = 0
-
-        for script in scripts:
-            script_name, description, prompt_text, script_code = script
-            prompt_lower = prompt_text.lower()
-
-            # Count matching keywords
-            keywords = set(prompt_lower.split())
-            query_keywords = set(query_lower.split())
-            matches = len(keywords & query_keywords)
-            score = matches / max(len(keywords), len(query_keywords))
+        if not scripts:
+            return None
 
-            if score > best_score:
-                best_score = score
-                best_match = (script_name, script_code, score)
+        # Share of matching keywords, against precomputed prompt keyword sets
+        query_keywords = set(query.lower().split())
+        query_len = len(query_keywords)
+        scores = [
+            len(keywords & query_keywords) / max(len(keywords), query_len)
+            for keywords in self._script_keyword_sets
+        ]
+        best_idx = max(range(len(scores)), key=scores.__getitem__)
+        best_score = scores[best_idx]
 
         if best_score >= 0.3:
-            return best_match
+            script_name, description, prompt_text, script_code = scripts[best_idx]
+            return script_name, script_code, best_score
         return None
 
     def extract_loan_servicer(self, query: str) -> Optional[str]:
@@ -171,19 +229,11 @@ Your response must be a single number only."""
 
     def extract_program_name(self, query: str) -> Optional[str]:
         """Extract program_name parameter from query."""
-        if re.search(r'\bacross\s+programs?\b', query, re.IGNORECASE):
+        if _ACROSS_PROGRAMS_RE.search(query):
             return None
 
-        patterns = [
-            r'by\s+([A-Za-z0-9/\s\-]+?)\s+(?:in|from)',
-            r'for\s+([A-Za-z0-9/\s\-]+?)\s+(?:in|from)',
-            r'for\s+([A-Za-z0-9/\s\-]+?)$',
-            r'by\s+([A-Za-z0-9/\s\-]+?)$',
-            r'((?:PRMG/|LoanStream)[A-Za-z0-9/\s\-]+?)\s+program'
-        ]
-
-        for pattern in patterns:
-            match = re.search(pattern, query, re.IGNORECASE)
+        for pattern in _PROGRAM_NAME_PATTERNS:
+            match = pattern.search(query)
             if match:
                 return match.group(1).strip()
 
@@ -191,11 +241,11 @@ Your response must be a single number only."""
 
     def extract_param_name(self, query: str) -> Optional[str]:
         """Extract param_name parameter from query."""
-        match = re.search(r'(\w+)\s+parameter', query, re.IGNORECASE)
+        match = _PARAM_NAME_RE.search(query)
         if match:
             return match.group(1)
 
-        match = re.search(r'(?:find|show)\s+(\w+)\s+(?:across|for)', query, re.IGNORECASE)
+        match = _FIND_PARAM_RE.search(query)
         if match:
             return match.group(1)
 
@@ -205,35 +255,29 @@ Your response must be a single number only."""
         """Extract borrower parameters from matching queries."""
         params = {}
 
-        credit_match = re.search(r'(\d{3})\s*credit\s*score', query, re.IGNORECASE)
-        if credit_match:
-            params['borrower_credit_score'] = credit_match.group(1)
-
-        loan_match = re.search(r'\$?([\d,]+)\s*loan\s*amount', query, re.IGNORECASE)
-        if loan_match:
-            params['loan_amount'] = loan_match.group(1).replace(',', '')
-
-        ltv_match = re.search(r'(\d+(?:\.\d+)?)\s*%?\s*LTV', query, re.IGNORECASE)
-        if ltv_match:
-            params['ltv'] = ltv_match.group(1)
-
-        dti_match = re.search(r'(\d+(?:\.\d+)?)\s*%?\s*DTI', query, re.IGNORECASE)
-        if dti_match:
-            params['dti'] = dti_match.group(1)
-
-        if re.search(r'\bpurchase\b', query, re.IGNORECASE):
-            params['transaction_type'] = 'Purchase'
-        elif re.search(r'\bcash\s*out\b', query, re.IGNORECASE):
-            params['transaction_type'] = 'Cash Out'
-        elif re.search(r'\brate\s*(?:and|&)?\s*term\b', query, re.IGNORECASE):
-            params['transaction_type'] = 'Rate & Term'
-
-        if re.search(r'\bowner\s*occupied\b', query, re.IGNORECASE):
-            params['occupancy'] = 'Owner Occupied'
-        elif re.search(r'\bsecond\s*home\b', query, re.IGNORECASE):
-            params['occupancy'] = 'Second Home'
-        elif re.search(r'\binvestment\b', query, re.IGNORECASE):
-            params['occupancy'] = 'Investment'
+        # First occurrence of each kind, in a single pass over the query
+        found = {}
+        for match in _BORROWER_RE.finditer(query):
+            found.setdefault(match.lastgroup, match.group(match.lastgroup))
+
+        if 'credit_score' in found:
+            params['borrower_credit_score'] = found['credit_score']
+        if 'loan_amount' in found:
+            params['loan_amount'] = found['loan_amount'].replace(',', '')
+        if 'ltv' in found:
+            params['ltv'] = found['ltv']
+        if 'dti' in found:
+            params['dti'] = found['dti']
+
+        for key, transaction_type in _TRANSACTION_TYPES:
+            if key in found:
+                params['transaction_type'] = transaction_type
+                break
+
+        for key, occupancy in _OCCUPANCY_TYPES:
+            if key in found:
+                params['occupancy'] = occupancy
+                break
 
         return params
 
@@ -267,13 +311,16 @@ Your response must be a single number only."""
     def execute_script(self, script_code: str, parameters: Dict[str, str]) -> bool:
         """Execute script with extracted parameters and context."""
         try:
-            context = {}
-            query_context_json = os.environ.get('QUERY_CONTEXT', '{}')
-            if query_context_json:
-                try:
-                    context = json.loads(query_context_json)
-                except json.JSONDecodeError:
-                    pass
+            # Set by QueryEngine for in-process queries; CLI runs pass it via the environment
+            context = QUERY_CONTEXT.get()
+            if context is None:
+                context = {}
+                query_context_json = os.environ.get('QUERY_CONTEXT', '{}')
+                if query_context_json:
+                    try:
+                        context = json.loads(query_context_json)
+                    except json.JSONDecodeError:
+                        pass
 
             all_params = {
                 **parameters,
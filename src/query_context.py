@@ -0,0 +1,11 @@
+#!/usr/bin/env python3
+"""
+Per-query context shared between the web layer and the parsers.
+QueryEngine sets it around each query; parsers read it while executing scripts.
+"""
+
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+# Context params of the query currently executing (selected_programs, selected_servicers, ...)
+QUERY_CONTEXT: ContextVar[Optional[Dict]] = ContextVar('QUERY_CONTEXT', default=None)
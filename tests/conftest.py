@@ -4,53 +4,251 @@ Provides shared test fixtures, mock data, and test database setup.
 """
 
 import os
+import re
 import sys
-import tempfile
+import contextlib
 import sqlite3
 import pytest
 from pathlib import Path
-from unittest.mock import Mock, MagicMock
-from typing import Generator
+from types import SimpleNamespace
+from unittest.mock import Mock, create_autospec, patch
+from typing import Any, Callable, ContextManager, Dict, Generator, List, Optional
 
-# Add project paths
 project_root = Path(__file__).parent.parent
-sys.path.insert(0, str(project_root))
-sys.path.insert(0, str(project_root / "src"))
-sys.path.insert(0, str(project_root / "web-app"))
+
+# Tests mock the Anthropic client; never serve tool selections cached by earlier runs
+os.environ.setdefault('QUERY_CACHE_TTL', '0')
+
+
+# Tests run against the actual database in project root
+TEST_DB_PATH = project_root / "loanpilot.db"
+
+MOCK_DB_COLUMNS = (
+    "id", "loan_servicer", "program_name", "program_summary",
+    "borrower_credit_score", "loan_amount", "ltv", "dti",
+    "transaction_type", "occupancy", "citizenship",
+    "appraisal_requirements", "reserves", "income_documentation"
+)
+
+TEST_MARKERS = {
+    "unit": "fast tests with no external dependencies",
+    "integration": "end-to-end tests that run scripts against the database (opt-in)",
+    "requires_api_key": "tests that exercise the Anthropic client path (mocked)",
+    "requires_db": "tests that query loanpilot.db (opt-in)",
+}
+
+
+def pytest_configure(config):
+    """Register test markers and add project paths before collection."""
+    for marker, description in TEST_MARKERS.items():
+        config.addinivalue_line("markers", f"{marker}: {description}")
+
+    for path in (project_root, project_root / "src", project_root / "web-app"):
+        if str(path) not in sys.path:
+            sys.path.insert(0, str(path))
 
 
 @pytest.fixture(scope="session")
 def test_db_path() -> Generator[str, None, None]:
-    """Use the actual loanpilot.db database for testing."""
-    # Point to the actual database in project root
-    db_path = str(project_root / "loanpilot.db")
+    """
+    Use the actual loanpilot.db database for testing.
 
-    # Verify database exists
-    if not Path(db_path).exists():
-        raise FileNotFoundError(f"Database not found at {db_path}. Please ensure loanpilot.db exists.")
+    Checked once, on first use; tests that need it are skipped when it is
+    missing, so DB-free tests still run.
+    """
+    if not TEST_DB_PATH.exists():
+        pytest.skip(f"Database not found at {TEST_DB_PATH}. Please ensure loanpilot.db exists.")
 
-    yield db_path
+    yield str(TEST_DB_PATH)
     # No cleanup - we're using the real database
 
 
+@pytest.fixture(scope="session")
+def prime_citizenship(test_db_path) -> Dict[str, Optional[str]]:
+    """
+    Prime program name -> citizenship value, read once per session.
+
+    Read on first use, so only sessions that select a DB-backed test query programs_v3.
+    """
+    conn = sqlite3.connect(f"{Path(test_db_path).as_uri()}?mode=ro", uri=True)
+    try:
+        return dict(conn.execute(
+            "SELECT program_name, citizenship FROM programs_v3 WHERE loan_servicer = 'Prime'"
+        ))
+    finally:
+        conn.close()
+
+
+@pytest.fixture(scope="session")
+def shared_db_uri(test_db_path) -> str:
+    """
+    Read-only, shared-cache URI for the test database.
+
+    Connections opened with it share one page cache, kept warm by
+    shared_db_conn. Scripts cannot use it (they need a plain path).
+    """
+    return f"{Path(test_db_path).as_uri()}?mode=ro&cache=shared"
+
+
+@pytest.fixture(scope="session")
+def shared_db_conn(shared_db_uri) -> Generator[sqlite3.Connection, None, None]:
+    """Read-only connection to the test database, shared across the session."""
+    conn = sqlite3.connect(shared_db_uri, uri=True, check_same_thread=False)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture(scope="session")
+def cached_db_columns(shared_db_conn) -> List[str]:
+    """programs_v3 column names, read once per session."""
+    return [row[1] for row in shared_db_conn.execute("PRAGMA table_info(programs_v3)")]
+
+
+@pytest.fixture(scope="session")
+def memory_db_uri(test_db_path) -> Generator[str, None, None]:
+    """
+    Shared in-memory copy of the test database, as a file: URI.
+
+    A keep-alive connection holds the copy for the session. Only for parsers
+    that do not run scripts: scripts connect with sqlite3.connect(db_path),
+    which does not accept URIs. Each xdist worker process builds its own copy.
+    """
+    uri = f"file:loanpilot_mem_{os.getpid()}?mode=memory&cache=shared"
+    keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    source = sqlite3.connect(test_db_path)
+    source.backup(keeper)
+    source.close()
+    yield uri
+    keeper.close()
+
+
+@pytest.fixture(scope="session")
+def schema_db_uri() -> Generator[str, None, None]:
+    """
+    Shared in-memory database holding an empty programs_v3 with MOCK_DB_COLUMNS.
+
+    For tests that only need the schema, so they run without loanpilot.db.
+    """
+    uri = f"file:loanpilot_schema_{os.getpid()}?mode=memory&cache=shared"
+    keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    keeper.execute(f"CREATE TABLE programs_v3 ({', '.join(MOCK_DB_COLUMNS)})")
+    yield uri
+    keeper.close()
+
+
+@pytest.fixture(scope="session")
+def readonly_parser(schema_db_uri):
+    """
+    ContextAwareParser shared by tests that only read its state.
+
+    Reads the schema-only database, so it needs no loanpilot.db. Built without
+    ANTHROPIC_API_KEY; the key is only read at construction, so the
+    environment is restored immediately afterwards.
+    """
+    from src.context_aware_parser import ContextAwareParser
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.delenv("ANTHROPIC_API_KEY", raising=False)
+        parser = ContextAwareParser(db_path=schema_db_uri)
+
+    # Warm the alias and fuzzy-match paths once; _map_param_name memoizes
+    # per instance, so the mapping tests share the results
+    parser._map_param_name('appraisal')
+    parser._map_param_name('occupanc')
+
+    yield parser
+    parser.close()
+
+
+@pytest.fixture(scope="session")
+def shared_engine(memory_db_uri):
+    """
+    QueryEngine shared by tests that don't exercise construction.
+
+    Reads the in-memory copy of the database and is built without
+    ANTHROPIC_API_KEY; tests that swap in parser_mock must restore the real
+    parser (patch_attr does). Scripts need a file path, so tests that run them
+    must keep their own engine on test_db_path.
+    """
+    import query_engine
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.delenv("ANTHROPIC_API_KEY", raising=False)
+        engine = query_engine.QueryEngine(db_path=memory_db_uri, use_llm=False)
+
+    yield engine
+    if hasattr(engine.parser, 'close'):
+        engine.parser.close()
+
+
+@pytest.fixture
+def scratchpad(shared_engine) -> Generator[Callable[[str], None], None, None]:
+    """Set the scratchpad text shared_engine returns, in memory; cleared after the test."""
+    yield shared_engine.set_scratchpad_override
+    shared_engine.set_scratchpad_override(None)
+
+
+@pytest.fixture(scope="session")
+def parser_mock_template():
+    """Autospec of the engine's parser class, built once per session."""
+    import query_engine
+
+    return create_autospec(query_engine.QueryParser, instance=True)
+
+
+@pytest.fixture
+def parser_mock(parser_mock_template):
+    """
+    The session parser mock, reset so each test starts unconfigured.
+
+    Reset rather than copied: copy.copy shares child mocks, so a configured
+    return_value would leak into later tests.
+    """
+    parser_mock_template.reset_mock(return_value=True, side_effect=True)
+    return parser_mock_template
+
+
+def make_tool_use(name=None, tool_input=None) -> SimpleNamespace:
+    """Build a tool_use content block; responses are only read, so no mock is needed."""
+    return SimpleNamespace(type="tool_use", name=name, input=tool_input)
+
+
+def make_response(blocks) -> SimpleNamespace:
+    """Build a messages.create response holding the given content blocks."""
+    return SimpleNamespace(content=list(blocks))
+
+
+def make_client(response) -> Mock:
+    """Build a client whose messages.create returns response and records calls."""
+    return Mock(messages=Mock(create=Mock(return_value=response)))
+
+
 @pytest.fixture
 def mock_anthropic_client():
     """Mock Anthropic API client for testing without real API calls."""
-    mock_client = MagicMock()
-
     # Mock messages.create for tool calling
-    mock_message = MagicMock()
-    mock_tool_use = MagicMock()
-    mock_tool_use.type = "tool_use"
-    mock_tool_use.name = "find_param_across_programs"
-    mock_tool_use.input = {
-        "param_name": "citizenship",
-        "loan_servicer": "Prime"
-    }
-    mock_message.content = [mock_tool_use]
-    mock_client.messages.create.return_value = mock_message
+    return make_client(make_response([make_tool_use(
+        "find_param_across_programs",
+        {
+            "param_name": "citizenship",
+            "loan_servicer": "Prime"
+        }
+    )]))
+
+
+@pytest.fixture
+def anthropic_mock():
+    """
+    Patch the parser's Anthropic class with a client returning one tool_use block.
 
-    return mock_client
+    Yields (mock_client, mock_tool_use); tests set .name and .input on the tool.
+    """
+    with patch('src.context_aware_parser.Anthropic') as mock_anthropic_class:
+        mock_tool_use = make_tool_use()
+        mock_client = make_client(make_response([mock_tool_use]))
+        mock_anthropic_class.return_value = mock_client
+
+        yield mock_client, mock_tool_use
 
 
 @pytest.fixture
@@ -59,6 +257,12 @@ def mock_env_with_api_key(monkeypatch):
     monkeypatch.setenv("ANTHROPIC_API_KEY", "sk-test-key-123456789")
 
 
+@pytest.fixture
+def no_api_key(monkeypatch):
+    """Remove ANTHROPIC_API_KEY so parsers and engines start without a client."""
+    monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+
+
 @pytest.fixture
 def sample_context_params():
     """Sample context parameters for query testing."""
@@ -77,54 +281,70 @@ PRMG/Plus Connect: U.S. Citizen
 """
 
 
+@pytest.fixture(scope="session")
+def scratchpad_dir(tmp_path_factory) -> Path:
+    """Session-wide directory holding each test's scratchpad file."""
+    return tmp_path_factory.mktemp("scratchpads")
+
+
 @pytest.fixture
-def temp_scratchpad() -> Generator[str, None, None]:
-    """Create temporary scratchpad file for testing."""
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.scratchpad', delete=False) as tmp:
-        scratchpad_path = tmp.name
+def temp_scratchpad(scratchpad_dir, request) -> str:
+    """Create temporary scratchpad file for testing (pytest prunes old temp dirs)."""
+    test_name = re.sub(r'[^\w.-]', '_', request.node.name)
+    scratchpad_path = scratchpad_dir / f"{test_name}.scratchpad"
+    scratchpad_path.touch()
+    return str(scratchpad_path)
 
-    yield scratchpad_path
 
-    # Cleanup
-    try:
-        os.unlink(scratchpad_path)
-    except:
-        pass
+@pytest.fixture(scope="session")
+def read_scratchpad() -> Callable[[str], str]:
+    """Read a scratchpad file, memoized by (path, mtime) so unchanged files are read once."""
+    cache = {}
 
+    def _read(path: str) -> str:
+        key = (path, os.stat(path).st_mtime_ns)
+        if key not in cache:
+            cache[key] = Path(path).read_text()
+        return cache[key]
 
-@pytest.fixture
+    return _read
+
+
+@pytest.fixture(scope="session")
+def patch_attr() -> Callable[[Any, str, Any], ContextManager[Any]]:
+    """Temporarily replace an attribute with a plain swap, without unittest.mock's bookkeeping."""
+    @contextlib.contextmanager
+    def _patch(obj: Any, name: str, new: Any):
+        own = name in vars(obj)
+        old = getattr(obj, name)
+        setattr(obj, name, new)
+        try:
+            yield new
+        finally:
+            # Methods found on the class go back to being looked up there
+            if own:
+                setattr(obj, name, old)
+            else:
+                delattr(obj, name)
+
+    return _patch
+
+
+@pytest.fixture(scope="session")
 def mock_db_columns():
-    """Mock database column list."""
-    return [
-        "id", "loan_servicer", "program_name", "program_summary",
-        "borrower_credit_score", "loan_amount", "ltv", "dti",
-        "transaction_type", "occupancy", "citizenship",
-        "appraisal_requirements", "reserves", "income_documentation"
-    ]
-
-
-@pytest.fixture(autouse=True)
-def reset_environment():
-    """Reset environment variables before each test."""
-    # Store original values
-    original_db_path = os.environ.get('DB_PATH')
-    original_scratchpad = os.environ.get('SCRATCHPAD_PATH')
-    original_api_key = os.environ.get('ANTHROPIC_API_KEY')
-
-    yield
-
-    # Restore original values
-    if original_db_path:
-        os.environ['DB_PATH'] = original_db_path
-    elif 'DB_PATH' in os.environ:
-        del os.environ['DB_PATH']
-
-    if original_scratchpad:
-        os.environ['SCRATCHPAD_PATH'] = original_scratchpad
-    elif 'SCRATCHPAD_PATH' in os.environ:
-        del os.environ['SCRATCHPAD_PATH']
-
-    if original_api_key:
-        os.environ['ANTHROPIC_API_KEY'] = original_api_key
-    elif 'ANTHROPIC_API_KEY' in os.environ:
-        del os.environ['ANTHROPIC_API_KEY']
+    """Mock database column list (immutable; use list() to modify)."""
+    return MOCK_DB_COLUMNS
+
+
+@pytest.fixture(scope="session", autouse=True)
+def session_environ():
+    """Restore os.environ once the session ends; per-test changes go through monkeypatch."""
+    with patch.dict(os.environ):
+        yield
+
+
+@pytest.fixture
+def isolated_environ():
+    """Restore os.environ after a test whose code under test writes to it directly."""
+    with patch.dict(os.environ):
+        yield
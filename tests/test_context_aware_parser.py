@@ -5,7 +5,7 @@ Tests the context-aware query parser with Anthropic tool calling.
 
 import pytest
 import os
-from unittest.mock import Mock, MagicMock, patch
+from unittest.mock import patch
 from src.context_aware_parser import ContextAwareParser
 
 
@@ -13,11 +13,9 @@ from src.context_aware_parser import ContextAwareParser
 class TestContextAwareParser:
     """Test suite for ContextAwareParser class."""
 
-    def test_initialization_without_api_key(self, test_db_path, temp_scratchpad, monkeypatch):
+    @pytest.mark.requires_db
+    def test_initialization_without_api_key(self, test_db_path, temp_scratchpad, no_api_key):
         """Test parser initialization when ANTHROPIC_API_KEY is missing."""
-        # Remove API key from environment
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
-
         parser = ContextAwareParser(db_path=test_db_path)
 
         assert parser.anthropic is None
@@ -26,6 +24,7 @@ class TestContextAwareParser:
         assert len(parser.script_tools) > 0
 
     @pytest.mark.requires_api_key
+    @pytest.mark.requires_db
     def test_initialization_with_api_key(self, test_db_path, mock_env_with_api_key):
         """Test parser initialization with ANTHROPIC_API_KEY set."""
         with patch('src.context_aware_parser.Anthropic') as mock_anthropic:
@@ -34,12 +33,14 @@ class TestContextAwareParser:
             assert parser.anthropic is not None
             mock_anthropic.assert_called_once()
 
-    def test_get_database_columns(self, test_db_path):
+    @pytest.mark.requires_db
+    def test_get_database_columns(self, shared_db_uri, cached_db_columns, no_api_key):
         """Test database column retrieval from actual database."""
-        parser = ContextAwareParser(db_path=test_db_path)
+        parser = ContextAwareParser(db_path=shared_db_uri)
 
         # Verify parser found columns from actual database
         assert len(parser.db_columns) > 0
+        assert list(parser.db_columns) == cached_db_columns
 
         # Verify essential core columns exist (these should always be in programs_v3)
         essential_columns = [
@@ -47,12 +48,11 @@ class TestContextAwareParser:
             'occupancy', 'ltv'
         ]
 
-        assert all(col in parser.db_columns for col in essential_columns)
+        assert all(col in cached_db_columns for col in essential_columns)
 
-    def test_build_script_tools(self, test_db_path, monkeypatch):
+    def test_build_script_tools(self, readonly_parser):
         """Test script tool definitions are correctly built."""
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
-        parser = ContextAwareParser(db_path=test_db_path)
+        parser = readonly_parser
 
         tools = parser.script_tools
 
@@ -72,70 +72,60 @@ class TestContextAwareParser:
         assert 'param_name' in param_tool['input_schema']['properties']
         assert 'loan_servicer' in param_tool['input_schema']['properties']
 
-    def test_map_param_name_direct_match(self, test_db_path, monkeypatch):
+    def test_map_param_name_direct_match(self, readonly_parser):
         """Test parameter name mapping with direct match."""
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
-        parser = ContextAwareParser(db_path=test_db_path)
+        parser = readonly_parser
 
         assert parser._map_param_name('citizenship') == 'citizenship'
         assert parser._map_param_name('ltv') == 'ltv'
 
-    def test_map_param_name_alias(self, test_db_path, monkeypatch):
+    def test_map_param_name_alias(self, readonly_parser):
         """Test parameter name mapping with aliases."""
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
-        parser = ContextAwareParser(db_path=test_db_path)
+        parser = readonly_parser
 
         assert parser._map_param_name('appraisal') == 'appraisal_requirements'
         assert parser._map_param_name('reserves') == 'reserves'
         assert parser._map_param_name('docs') == 'income_documentation'
 
-    def test_map_param_name_fuzzy_match(self, test_db_path, monkeypatch):
+    def test_map_param_name_fuzzy_match(self, readonly_parser):
         """Test parameter name mapping with fuzzy matching."""
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
-        parser = ContextAwareParser(db_path=test_db_path)
+        parser = readonly_parser
 
         # Fuzzy match should work for close matches
         result = parser._map_param_name('occupanc')
         assert result == 'occupancy'
 
     @pytest.mark.requires_api_key
-    def test_parse_query_with_context(self, test_db_path, temp_scratchpad, mock_env_with_api_key):
+    @pytest.mark.requires_db
+    def test_parse_query_with_context(self, shared_db_uri, shared_db_conn, temp_scratchpad, mock_env_with_api_key,
+                                      anthropic_mock):
         """Test query parsing with context parameters."""
-        with patch('src.context_aware_parser.Anthropic') as mock_anthropic_class:
-            # Setup mock Anthropic response
-            mock_client = MagicMock()
-            mock_anthropic_class.return_value = mock_client
-
-            mock_tool_use = MagicMock()
-            mock_tool_use.type = "tool_use"
-            mock_tool_use.name = "find_param_across_programs"
-            mock_tool_use.input = {
-                "param_name": "citizenship",
-                "loan_servicer": "Prime"
-            }
-
-            mock_message = MagicMock()
-            mock_message.content = [mock_tool_use]
-            mock_client.messages.create.return_value = mock_message
+        # Setup mock Anthropic response
+        mock_client, mock_tool_use = anthropic_mock
+        mock_tool_use.name = "find_param_across_programs"
+        mock_tool_use.input = {
+            "param_name": "citizenship",
+            "loan_servicer": "Prime"
+        }
 
-            parser = ContextAwareParser(db_path=test_db_path)
+        parser = ContextAwareParser(db_path=shared_db_uri)
 
-            result = parser.parse_query_with_context(
-                "What are the citizenship requirements?",
-                selected_programs=["PRMG/Prime Connect"],
-                selected_servicers=["Prime"]
-            )
+        # No selected programs, so the direct keyword match falls through to the model
+        result = parser.parse_query_with_context(
+            "What are the citizenship requirements?",
+            selected_servicers=["Prime"]
+        )
 
-            assert result['script_name'] == 'find_param_across_programs'
-            assert result['parameters']['param_name'] == 'citizenship'
-            assert result['parameters']['loan_servicer'] == 'Prime'
-            assert result['confidence'] == 0.95
+        mock_client.messages.create.assert_called_once()
+        assert result['script_name'] == 'find_param_across_programs'
+        assert result['parameters']['param_name'] == 'citizenship'
+        assert result['parameters']['loan_servicer'] == 'Prime'
+        assert result['confidence'] == 0.95
 
-    def test_parse_query_without_anthropic(self, test_db_path, temp_scratchpad, monkeypatch):
+    @pytest.mark.requires_db
+    def test_parse_query_without_anthropic(self, shared_db_uri, shared_db_conn, temp_scratchpad, no_api_key):
         """Test query parsing when Anthropic client is not available."""
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
-
-        parser = ContextAwareParser(db_path=test_db_path)
+        parser = ContextAwareParser(db_path=shared_db_uri)
 
         result = parser.parse_query_with_context(
             "What are the citizenship requirements?",
@@ -147,10 +137,42 @@ class TestContextAwareParser:
         assert 'error' in result
         assert 'Anthropic API not available' in result['error']
 
+    def test_direct_param_query_single_parameter(self, readonly_parser):
+        """Test a single-parameter question about selected programs is routed without the model."""
+        result = readonly_parser._match_direct_param_query(
+            "What are the citizenship requirements?",
+            selected_programs=["PRMG/Prime Connect"]
+        )
+
+        assert result['script_name'] == 'find_param_across_programs'
+        assert result['parameters'] == {
+            'param_name': 'citizenship',
+            'loan_servicer': 'Prime',
+            'selected_programs': ["PRMG/Prime Connect"]
+        }
+
+    @pytest.mark.parametrize("query,selected_programs,selected_servicers", [
+        # Two parameters need the model to choose
+        ("What are the citizenship and occupancy requirements?", ["PRMG/Prime Connect"], None),
+        # Numbers describe a borrower profile, not a parameter lookup
+        ("Citizenship requirements for a 700 score", ["PRMG/Prime Connect"], None),
+        # Eligibility questions ask which programs fit, for match_programs
+        ("Which of these programs allow borrowers with no credit history?", ["PRMG/Prime Connect"], None),
+        ("Do any of these programs accept foreign nationals without a credit score?", ["PRMG/Prime Connect"], None),
+        ("Which of these programs allow non-owner occupancy", ["PRMG/Prime Connect"], None),
+        # Programs from more than one servicer
+        ("What are the citizenship requirements?", ["PRMG/Prime Connect", "LoanStream-Core NonQM"], None),
+        ("What are the citizenship requirements?", ["PRMG/Prime Connect"], ["Prime", "LoanStream"]),
+        # Nothing selected
+        ("What are the citizenship requirements?", None, ["Prime"]),
+    ])
+    def test_direct_param_query_falls_through(self, readonly_parser, query, selected_programs, selected_servicers):
+        """Test queries the direct match can't settle are left to the model."""
+        assert readonly_parser._match_direct_param_query(query, selected_programs, selected_servicers) is None
+
     @pytest.mark.requires_db
-    def test_execute_script(self, test_db_path, temp_scratchpad, monkeypatch):
+    def test_execute_script(self, test_db_path, temp_scratchpad, read_scratchpad, no_api_key, monkeypatch):
         """Test script execution with parameters."""
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
         monkeypatch.setenv("SCRATCHPAD_PATH", temp_scratchpad)
 
         parser = ContextAwareParser(db_path=test_db_path)
@@ -167,13 +189,12 @@ class TestContextAwareParser:
         assert success is True
 
         # Check scratchpad output
-        with open(temp_scratchpad, 'r') as f:
-            output = f.read()
-            assert len(output) > 0
+        output = read_scratchpad(temp_scratchpad)
+        assert len(output) > 0
 
-    def test_execute_script_not_found(self, test_db_path, temp_scratchpad, monkeypatch):
+    @pytest.mark.requires_db
+    def test_execute_script_not_found(self, test_db_path, temp_scratchpad, read_scratchpad, no_api_key, monkeypatch):
         """Test execution of non-existent script."""
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
         monkeypatch.setenv("SCRATCHPAD_PATH", temp_scratchpad)
 
         parser = ContextAwareParser(db_path=test_db_path)
@@ -183,43 +204,33 @@ class TestContextAwareParser:
         assert success is False
 
         # Check error message in scratchpad
-        with open(temp_scratchpad, 'r') as f:
-            output = f.read()
-            assert 'not found' in output.lower()
+        output = read_scratchpad(temp_scratchpad)
+        assert 'not found' in output.lower()
 
     @pytest.mark.requires_db
-    def test_parse_and_execute_removes_prefix(self, test_db_path, temp_scratchpad, mock_env_with_api_key, monkeypatch):
+    def test_parse_and_execute_removes_prefix(self, test_db_path, temp_scratchpad, mock_env_with_api_key,
+                                              anthropic_mock, monkeypatch):
         """Test that ^ prefix is removed from query before processing."""
-        with patch('src.context_aware_parser.Anthropic') as mock_anthropic_class:
-            mock_client = MagicMock()
-            mock_anthropic_class.return_value = mock_client
-
-            # Setup mock for successful parsing
-            mock_tool_use = MagicMock()
-            mock_tool_use.type = "tool_use"
-            mock_tool_use.name = "match_programs"
-            mock_tool_use.input = {}
+        # Setup mock for successful parsing
+        mock_client, mock_tool_use = anthropic_mock
+        mock_tool_use.name = "match_programs"
+        mock_tool_use.input = {}
 
-            mock_message = MagicMock()
-            mock_message.content = [mock_tool_use]
-            mock_client.messages.create.return_value = mock_message
-
-            parser = ContextAwareParser(db_path=test_db_path)
-            monkeypatch.setenv("SCRATCHPAD_PATH", temp_scratchpad)
+        parser = ContextAwareParser(db_path=test_db_path)
+        monkeypatch.setenv("SCRATCHPAD_PATH", temp_scratchpad)
 
-            # Query with ^ prefix
-            success = parser.parse_and_execute("^ match programs")
+        # Query with ^ prefix
+        success = parser.parse_and_execute("^ match programs")
 
-            # Should still succeed after removing prefix
-            mock_client.messages.create.assert_called_once()
-            call_args = mock_client.messages.create.call_args
-            query_in_message = call_args[1]['messages'][0]['content']
-            assert '^' not in query_in_message
+        # Should still succeed after removing prefix
+        mock_client.messages.create.assert_called_once()
+        call_args = mock_client.messages.create.call_args
+        query_in_message = call_args[1]['messages'][0]['content']
+        assert '^' not in query_in_message
 
-    def test_tool_definitions_have_required_fields(self, test_db_path, monkeypatch):
+    def test_tool_definitions_have_required_fields(self, readonly_parser):
         """Test that all tool definitions have required fields."""
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
-        parser = ContextAwareParser(db_path=test_db_path)
+        parser = readonly_parser
 
         for tool in parser.script_tools:
             assert 'name' in tool
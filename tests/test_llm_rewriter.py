@@ -0,0 +1,47 @@
+"""
+Unit tests for llm_rewriter.py
+Tests the local RAG shortcut that rewrites simple parameter lookups without Claude.
+"""
+
+import pytest
+from src.llm_rewriter import LLMRewriter, RAG_SHORTCUT_THRESHOLD
+
+CONFIDENT_HIT = [{'column_name': 'borrower_credit_score', 'relevance_score': RAG_SHORTCUT_THRESHOLD + 0.1}]
+
+
+@pytest.mark.unit
+class TestRewriteFromRag:
+    """Test suite for LLMRewriter._rewrite_from_rag."""
+
+    @pytest.mark.parametrize("query", [
+        "What are the credit score requirements",
+        "What is the credit score requirement across programs",
+        "Find credit score across all programs",
+    ])
+    def test_parameter_lookup_rewritten(self, query):
+        """Test a plain parameter lookup is rewritten from the top RAG hit."""
+        assert LLMRewriter._rewrite_from_rag(query, CONFIDENT_HIT) == "Find borrower_credit_score across programs"
+
+    @pytest.mark.parametrize("query", [
+        # Borrower profiles belong to match_programs
+        "What are the programs that accept 620 credit score",
+        "find programs that allow 80 LTV",
+        "What are the credit score requirements for 620",
+        # Programs as the object of the question
+        "What are the programs that accept non-warrantable condos",
+        "Find programs without a credit score minimum",
+        # Qualified lookups
+        "What are the credit score requirements for Prime Connect",
+        # Not a lookup phrasing
+        "Which lenders take low credit scores",
+    ])
+    def test_other_queries_left_to_claude(self, query):
+        """Test queries that are not simple parameter lookups fall through."""
+        assert LLMRewriter._rewrite_from_rag(query, CONFIDENT_HIT) is None
+
+    def test_low_relevance_left_to_claude(self):
+        """Test a weak RAG hit never triggers the shortcut."""
+        weak_hit = [{'column_name': 'borrower_credit_score', 'relevance_score': RAG_SHORTCUT_THRESHOLD}]
+
+        assert LLMRewriter._rewrite_from_rag("What are the credit score requirements", weak_hit) is None
+        assert LLMRewriter._rewrite_from_rag("What are the credit score requirements", []) is None
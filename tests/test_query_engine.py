@@ -4,28 +4,23 @@ Tests the QueryEngine class for FastAPI integration.
 """
 
 import pytest
-import os
-import sys
-import json
-from unittest.mock import Mock, MagicMock, patch
 from pathlib import Path
 
-# Add web-app to path
-sys.path.insert(0, str(Path(__file__).parent.parent / "web-app"))
-
 import query_engine
 QueryEngine = query_engine.QueryEngine
 get_query_engine = query_engine.get_query_engine
 
+# QueryEngine writes SCRATCHPAD_PATH and DB_PATH to os.environ
+pytestmark = pytest.mark.usefixtures("isolated_environ")
+
 
 @pytest.mark.unit
 class TestQueryEngine:
     """Test suite for QueryEngine class."""
 
-    def test_initialization(self, test_db_path, monkeypatch):
+    @pytest.mark.requires_db
+    def test_initialization(self, test_db_path, no_api_key):
         """Test QueryEngine initialization."""
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
-
         engine = QueryEngine(db_path=test_db_path, use_llm=False)
 
         assert engine.db_path == test_db_path
@@ -38,18 +33,16 @@ class TestQueryEngine:
             QueryEngine(db_path="/nonexistent/path/to/db.db")
 
     @pytest.mark.requires_db
-    def test_execute_query_simple(self, test_db_path, monkeypatch):
+    def test_execute_query_simple(self, shared_engine, parser_mock, patch_attr, scratchpad):
         """Test simple query execution."""
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
-
-        engine = QueryEngine(db_path=test_db_path, use_llm=False)
+        engine = shared_engine
 
         # Mock parser to return success
-        with patch.object(engine.parser, 'parse_and_execute', return_value=True):
-            # Mock scratchpad file
+        parser_mock.parse_and_execute.return_value = True
+        with patch_attr(engine, 'parser', parser_mock):
+            # Mock scratchpad contents
             scratchpad_content = "PRMG/Prime Connect: Result data"
-            with open(engine.scratchpad_path, 'w') as f:
-                f.write(scratchpad_content)
+            scratchpad(scratchpad_content)
 
             result = engine.execute_query("test query")
 
@@ -59,23 +52,23 @@ class TestQueryEngine:
             assert 'executedAt' in result
 
     @pytest.mark.requires_db
-    def test_execute_query_with_context(self, test_db_path, sample_context_params, monkeypatch):
+    def test_execute_query_with_context(self, sample_context_params, shared_engine, parser_mock, patch_attr,
+                                        scratchpad):
         """Test query execution with context parameters."""
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
-
-        engine = QueryEngine(db_path=test_db_path, use_llm=False)
+        engine = shared_engine
 
         # Track if QUERY_CONTEXT was set during execution
         context_was_set = {'value': False}
 
         def check_context_during_execution(*args, **kwargs):
-            context_was_set['value'] = 'QUERY_CONTEXT' in os.environ
+            context_was_set['value'] = query_engine.QUERY_CONTEXT.get() is not None
             return True
 
-        with patch.object(engine.parser, 'parse_and_execute', side_effect=check_context_during_execution) as mock_exec:
+        parser_mock.parse_and_execute.side_effect = check_context_during_execution
+
+        with patch_attr(engine, 'parser', parser_mock):
             # Mock scratchpad
-            with open(engine.scratchpad_path, 'w') as f:
-                f.write("Test results")
+            scratchpad("Test results")
 
             result = engine.execute_query("test query", sample_context_params)
 
@@ -84,30 +77,28 @@ class TestQueryEngine:
             assert context_was_set['value'] is True
 
     @pytest.mark.requires_db
-    def test_execute_query_with_prefix(self, test_db_path, monkeypatch):
+    def test_execute_query_with_prefix(self, shared_engine, parser_mock, patch_attr, scratchpad):
         """Test query execution preserves ^ prefix if present."""
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+        engine = shared_engine
 
-        engine = QueryEngine(db_path=test_db_path, use_llm=False)
+        parser_mock.parse_and_execute.return_value = True
 
-        with patch.object(engine.parser, 'parse_and_execute', return_value=True):
-            with open(engine.scratchpad_path, 'w') as f:
-                f.write("Results")
+        with patch_attr(engine, 'parser', parser_mock):
+            scratchpad("Results")
 
             result = engine.execute_query("^ already has prefix")
 
             assert result['query'] == '^ already has prefix'
 
     @pytest.mark.requires_db
-    def test_execute_query_failure(self, test_db_path, monkeypatch):
+    def test_execute_query_failure(self, shared_engine, parser_mock, patch_attr, scratchpad):
         """Test query execution when parser fails."""
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+        engine = shared_engine
 
-        engine = QueryEngine(db_path=test_db_path, use_llm=False)
+        parser_mock.parse_and_execute.return_value = False
 
-        with patch.object(engine.parser, 'parse_and_execute', return_value=False):
-            with open(engine.scratchpad_path, 'w') as f:
-                f.write("Error: Query failed")
+        with patch_attr(engine, 'parser', parser_mock):
+            scratchpad("Error: Query failed")
 
             result = engine.execute_query("failing query")
 
@@ -115,24 +106,22 @@ class TestQueryEngine:
             assert 'Error' in result['results'] or 'failed' in result['results']
 
     @pytest.mark.requires_db
-    def test_execute_query_exception(self, test_db_path, monkeypatch):
+    def test_execute_query_exception(self, shared_engine, parser_mock, patch_attr):
         """Test query execution handles exceptions gracefully."""
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+        engine = shared_engine
 
-        engine = QueryEngine(db_path=test_db_path, use_llm=False)
+        parser_mock.parse_and_execute.side_effect = Exception("Test error")
 
-        with patch.object(engine.parser, 'parse_and_execute', side_effect=Exception("Test error")):
+        with patch_attr(engine, 'parser', parser_mock):
             result = engine.execute_query("error query")
 
             assert result['success'] is False
             assert 'Test error' in result['results']
 
     @pytest.mark.requires_db
-    def test_get_available_scripts(self, test_db_path, monkeypatch):
+    def test_get_available_scripts(self, shared_engine):
         """Test fetching available scripts from database."""
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
-
-        engine = QueryEngine(db_path=test_db_path, use_llm=False)
+        engine = shared_engine
 
         scripts = engine.get_available_scripts()
 
@@ -146,11 +135,9 @@ class TestQueryEngine:
         assert 'prompt' in script
 
     @pytest.mark.requires_db
-    def test_check_health(self, test_db_path, monkeypatch):
+    def test_check_health(self, shared_engine):
         """Test health check returns correct status."""
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
-
-        engine = QueryEngine(db_path=test_db_path, use_llm=False)
+        engine = shared_engine
 
         health = engine.check_health()
 
@@ -161,11 +148,9 @@ class TestQueryEngine:
         assert health.get('error') is None
 
     @pytest.mark.requires_db
-    def test_fetch_program_details(self, test_db_path, monkeypatch):
+    def test_fetch_program_details(self, shared_engine):
         """Test fetching program details from database."""
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
-
-        engine = QueryEngine(db_path=test_db_path, use_llm=False)
+        engine = shared_engine
 
         details = engine.fetch_program_details(
             programs=["PRMG/Prime Connect", "PRMG/Plus Connect"],
@@ -182,11 +167,9 @@ class TestQueryEngine:
         assert 'borrower_credit_score' in program_detail
 
     @pytest.mark.requires_db
-    def test_fetch_program_parameter(self, test_db_path, monkeypatch):
+    def test_fetch_program_parameter(self, shared_engine):
         """Test fetching specific parameter for a program."""
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
-
-        engine = QueryEngine(db_path=test_db_path, use_llm=False)
+        engine = shared_engine
 
         value = engine.fetch_program_parameter(
             program_name="PRMG/Prime Connect",
@@ -199,11 +182,9 @@ class TestQueryEngine:
         assert len(value) > 0
 
     @pytest.mark.requires_db
-    def test_fetch_program_parameter_missing(self, test_db_path, monkeypatch):
+    def test_fetch_program_parameter_missing(self, shared_engine):
         """Test fetching parameter for non-existent program."""
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
-
-        engine = QueryEngine(db_path=test_db_path, use_llm=False)
+        engine = shared_engine
 
         value = engine.fetch_program_parameter(
             program_name="NonExistent/Program",
@@ -213,25 +194,27 @@ class TestQueryEngine:
 
         assert value is None
 
-    def test_singleton_pattern(self, test_db_path, monkeypatch):
+    def test_singleton_pattern(self, monkeypatch):
         """Test get_query_engine returns singleton instance."""
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+        # Stand-in for the engine class that counts constructions; monkeypatch restores
+        # both module attributes after the test
+        instances = []
 
-        # Mock the default db path
-        with patch('query_engine.QueryEngine') as MockEngine:
-            mock_instance = MagicMock()
-            MockEngine.return_value = mock_instance
+        def make_engine(*args, **kwargs):
+            instances.append(object())
+            return instances[-1]
 
-            # Reset singleton
-            query_engine._query_engine = None
+        monkeypatch.setattr(query_engine, '_query_engine', None)
+        monkeypatch.setattr(query_engine, 'QueryEngine', make_engine)
 
-            # First call creates instance
-            engine1 = get_query_engine()
-            # Second call returns same instance
-            engine2 = get_query_engine()
+        # First call creates instance
+        engine1 = get_query_engine()
+        # Second call returns same instance
+        engine2 = get_query_engine()
 
-            # Should be called only once
-            assert MockEngine.call_count == 1
+        # Should be called only once
+        assert len(instances) == 1
+        assert engine1 is engine2
 
 
 @pytest.mark.unit
@@ -239,11 +222,9 @@ class TestQueryEngineContextHandling:
     """Test context parameter handling in QueryEngine."""
 
     @pytest.mark.requires_db
-    def test_context_params_with_selected_programs(self, test_db_path, monkeypatch):
+    def test_context_params_with_selected_programs(self, shared_engine, parser_mock, patch_attr, scratchpad):
         """Test context parameters are properly extracted from selected programs."""
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
-
-        engine = QueryEngine(db_path=test_db_path, use_llm=False)
+        engine = shared_engine
 
         context_params = {
             'selected_programs': ['PRMG/Prime Connect', 'PRMG/Plus Connect'],
@@ -254,13 +235,13 @@ class TestQueryEngineContextHandling:
         captured_context = {'value': None}
 
         def capture_context_during_execution(*args, **kwargs):
-            if 'QUERY_CONTEXT' in os.environ:
-                captured_context['value'] = json.loads(os.environ['QUERY_CONTEXT'])
+            captured_context['value'] = query_engine.QUERY_CONTEXT.get()
             return True
 
-        with patch.object(engine.parser, 'parse_and_execute', side_effect=capture_context_during_execution):
-            with open(engine.scratchpad_path, 'w') as f:
-                f.write("Results")
+        parser_mock.parse_and_execute.side_effect = capture_context_during_execution
+
+        with patch_attr(engine, 'parser', parser_mock):
+            scratchpad("Results")
 
             result = engine.execute_query("test", context_params)
 
@@ -270,17 +251,16 @@ class TestQueryEngineContextHandling:
             assert 'selected_servicers' in captured_context['value']
 
     @pytest.mark.requires_db
-    def test_context_cleanup(self, test_db_path, monkeypatch):
+    def test_context_cleanup(self, shared_engine, parser_mock, patch_attr, scratchpad):
         """Test that context is cleaned up from environment after execution."""
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+        engine = shared_engine
 
-        engine = QueryEngine(db_path=test_db_path, use_llm=False)
+        parser_mock.parse_and_execute.return_value = True
 
-        with patch.object(engine.parser, 'parse_and_execute', return_value=True):
-            with open(engine.scratchpad_path, 'w') as f:
-                f.write("Results")
+        with patch_attr(engine, 'parser', parser_mock):
+            scratchpad("Results")
 
             engine.execute_query("test", {'selected_programs': ['Test']})
 
             # Context should be removed after execution
-            assert 'QUERY_CONTEXT' not in os.environ
+            assert query_engine.QUERY_CONTEXT.get() is None
@@ -5,11 +5,17 @@ Creates prime_v3 and loanstream_v3 tables from data/v3/Non-QM_Matrix.xlsx - Attr
 Structure: rows = attributes, columns = metadata + programs (same as v2)
 """
 
+import sys
 import sqlite3
 import pandas as pd
 import logging
 from pathlib import Path
 
+# Add parent directory to path to import src modules
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.db_relations import drop_relation
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -42,36 +48,46 @@ def convert_v3_to_tables(tsv_path, conn):
         with open(tsv_path, 'rb') as f:
             binary_content = f.read()
 
-        # Remove embedded CRs within fields (they appear as \r followed by non-newline)
-        # Keep only CRs that are part of line endings
-        binary_content = binary_content.replace(b'\r\n', b'\n')  # CRLF -> LF
-        binary_content = binary_content.replace(b'\r', b'')       # Remove remaining CRs
-
-        # Decode to string
-        content = binary_content.decode('utf-8')
+        # Drop every CR in one pass: CRLF becomes LF, and lone CRs (embedded
+        # within fields) are removed rather than treated as line breaks
+        binary_content = binary_content.translate(None, b'\r')
 
-        # Parse the normalized content
-        from io import StringIO
-        df = pd.read_csv(StringIO(content), sep='\t', engine='python', on_bad_lines='warn')
+        # Parse the normalized bytes with the C parser; every cell is free-form
+        # text, so skip per-column type inference
+        from io import BytesIO
+        df = pd.read_csv(BytesIO(binary_content), sep='\t', engine='c', encoding='utf-8',
+                         on_bad_lines='warn', dtype=str, low_memory=False)
 
         logger.info(f"  Total rows: {len(df)}, Total columns: {len(df.columns)}")
         logger.info(f"  All columns: {list(df.columns)}")
 
-        # Define column groups
+        # Define column groups by position; names are only needed for logging
+        loanstream_idx = [i for i, col in enumerate(df.columns) if 'LoanStream' in col]
         metadata_cols = df.columns[0:4].tolist()
         prmg_cols = df.columns[4:13].tolist()
-        loanstream_cols = [col for col in df.columns if 'LoanStream' in col]
+        loanstream_cols = df.columns[loanstream_idx].tolist()
 
         logger.info(f"  Metadata columns: {metadata_cols}")
         logger.info(f"  PRMG columns ({len(prmg_cols)}): {prmg_cols}")
         logger.info(f"  LoanStream columns ({len(loanstream_cols)}): {loanstream_cols}")
 
-        # Create prime_v3 table (metadata + PRMG programs)
-        prime_v3_cols = metadata_cols + prmg_cols
-        df_prime = df[prime_v3_cols].copy()
+        # One-shot load: skip fsyncs and keep temp storage in memory. The journal
+        # mode is left alone, since the parsers may switch the database to WAL
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("PRAGMA temp_store=MEMORY")
+
+        # Databases built by create_v3_tables.py expose these as views over programs_v3
+        cursor = conn.cursor()
+        for view_name in ('prime_v3', 'loanstream_v3'):
+            drop_relation(cursor, view_name, types=('view',))
+
+        # Create prime_v3 table (metadata + PRMG programs, columns 0-12)
+        # A contiguous positional slice needs no label lookup, and to_sql only reads it, so no copy
+        df_prime = df.iloc[:, 0:13]
 
-        logger.info(f"\nCreating prime_v3 table with {len(prime_v3_cols)} columns")
-        df_prime.to_sql('prime_v3', conn, if_exists='replace', index=False)
+        logger.info(f"\nCreating prime_v3 table with {len(df_prime.columns)} columns")
+        df_prime.to_sql('prime_v3', conn, if_exists='replace', index=False, chunksize=500)
+        del df_prime
 
         cursor = conn.cursor()
         cursor.execute("SELECT COUNT(*) FROM prime_v3")
@@ -79,11 +95,10 @@ def convert_v3_to_tables(tsv_path, conn):
         logger.info(f"✓ Created prime_v3 with {count} rows")
 
         # Create loanstream_v3 table (metadata + LoanStream programs)
-        loanstream_v3_cols = metadata_cols + loanstream_cols
-        df_loanstream = df[loanstream_v3_cols].copy()
+        df_loanstream = df.iloc[:, list(range(4)) + loanstream_idx]
 
-        logger.info(f"\nCreating loanstream_v3 table with {len(loanstream_v3_cols)} columns")
-        df_loanstream.to_sql('loanstream_v3', conn, if_exists='replace', index=False)
+        logger.info(f"\nCreating loanstream_v3 table with {len(df_loanstream.columns)} columns")
+        df_loanstream.to_sql('loanstream_v3', conn, if_exists='replace', index=False, chunksize=500)
 
         cursor.execute("SELECT COUNT(*) FROM loanstream_v3")
         count = cursor.fetchone()[0]
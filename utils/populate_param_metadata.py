@@ -7,7 +7,7 @@ import sqlite3
 import json
 
 # Parameter metadata: column_name -> (display_name, common_terms, description, category)
-PARAMETERS = {
+_PARAMETERS = {
     # Core identifiers
     'loan_servicer': ('Loan Servicer', ['servicer', 'lender', 'loan provider'], 'The loan servicing company (Prime or LoanStream)', 'identifier'),
     'program_name': ('Program Name', ['program', 'product name'], 'Name of the loan program', 'identifier'),
@@ -96,22 +96,26 @@ PARAMETERS = {
     'time_since_last_cash_out': ('Time Since Last Cash Out', ['cash out seasoning', 'time since cash out'], 'Required time since last cash-out refinance', 'timing'),
 }
 
+# Rows in parameter_metadata column order, with common_terms serialized once at import
+PARAMETER_ROWS = tuple(
+    (column_name, display_name, json.dumps(common_terms, separators=(',', ':')), description, category)
+    for column_name, (display_name, common_terms, description, category) in _PARAMETERS.items()
+)
+
 def populate_metadata():
     """Populate parameter_metadata table with all parameters."""
     conn = sqlite3.connect('loanpilot.db')
+    # One-off populate: no need to fsync every page
+    conn.execute("PRAGMA synchronous=OFF")
     cursor = conn.cursor()
 
-    # Clear existing data
-    cursor.execute("DELETE FROM parameter_metadata")
-
-    # Insert all parameters
-    for column_name, (display_name, common_terms, description, category) in PARAMETERS.items():
-        cursor.execute('''
+    # Clear existing data and insert all parameters in a single transaction
+    with conn:
+        cursor.execute("DELETE FROM parameter_metadata")
+        cursor.executemany('''
             INSERT INTO parameter_metadata (column_name, display_name, common_terms, description, category)
             VALUES (?, ?, ?, ?, ?)
-        ''', (column_name, display_name, json.dumps(common_terms), description, category))
-
-    conn.commit()
+        ''', PARAMETER_ROWS)
 
     # Verify
     cursor.execute("SELECT COUNT(*) FROM parameter_metadata")
@@ -13,6 +13,7 @@ from typing import Dict, List, Optional
 import pandas as pd
 from io import StringIO
 
+from src.db_relations import drop_relation
 
 logger = logging.getLogger(__name__)
 
@@ -131,7 +132,7 @@ class DatabaseManager:
             cursor = conn.cursor()
 
             # Get table list and row counts
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
+            cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view') ORDER BY name")
             tables = {}
 
             for (table_name,) in cursor.fetchall():
@@ -217,7 +218,7 @@ class DatabaseManager:
                 }
 
             # Check 3: Required tables exist
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+            cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")
             tables = [row[0] for row in cursor.fetchall()]
             details["tables"] = tables
 
@@ -308,14 +309,18 @@ class DatabaseManager:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
 
-            # Get all table names
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-            tables = [row[0] for row in cursor.fetchall()]
+            # Get all table and view names (views first, since they depend on tables)
+            cursor.execute(
+                "SELECT name, type FROM sqlite_master WHERE type IN ('table', 'view') "
+                "ORDER BY type = 'table'"
+            )
+            relations = cursor.fetchall()
+            tables = [name for name, _ in relations]
 
             # Drop each table
-            for table in tables:
-                cursor.execute(f"DROP TABLE IF EXISTS {table}")
-                logger.info(f"  Dropped table: {table}")
+            for name, kind in relations:
+                cursor.execute(f"DROP {kind.upper()} IF EXISTS {name}")
+                logger.info(f"  Dropped {kind}: {name}")
 
             conn.commit()
             conn.close()
@@ -362,6 +367,10 @@ class DatabaseManager:
 
             # Connect to database
             conn = sqlite3.connect(self.db_path)
+            # Views over programs_v3 are rebuilt as tables below
+            cursor = conn.cursor()
+            for view_name in ("prime_v3", "loanstream_v3"):
+                drop_relation(cursor, view_name, types=('view',))
 
             # Create prime_v3 table (metadata + PRMG programs)
             metadata_cols = df.columns[0:4].tolist()
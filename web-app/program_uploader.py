@@ -12,6 +12,8 @@ from pathlib import Path
 from typing import Dict, List, Tuple, Optional
 from dataclasses import dataclass
 
+from src.db_relations import drop_relation, relation_type
+
 
 @dataclass
 class ValidationResult:
@@ -199,12 +201,12 @@ class ProgramUploader:
 
             # Add new column
             sql_col_name = f'"{program_name}"'  # Quote to handle special characters
-            cursor.execute(f'ALTER TABLE {table_name} ADD COLUMN {sql_col_name} TEXT')
+            target_table = self._add_program_column(cursor, table_name, sql_col_name, existing_cols)
 
             # Update each row with program data
             for idx, value in enumerate(program_data, start=1):
                 cursor.execute(
-                    f'UPDATE {table_name} SET {sql_col_name} = ? WHERE rowid = ?',
+                    f'UPDATE {target_table} SET {sql_col_name} = ? WHERE rowid = ?',
                     (str(value) if pd.notna(value) else '', idx)
                 )
 
@@ -231,6 +233,28 @@ class ProgramUploader:
                 "error": f"Import failed: {str(e)}"
             }
 
+    def _add_program_column(self, cursor, table_name: str, sql_col_name: str,
+                            existing_cols: List[str]) -> str:
+        """
+        Add a program column to a servicer table.
+        When the servicer table is a view over programs_v3, the column is added to
+        programs_v3 and the view is recreated to include it.
+
+        Returns: Name of the table that now holds the column
+        """
+        if relation_type(cursor, table_name) != 'view':
+            cursor.execute(f'ALTER TABLE {table_name} ADD COLUMN {sql_col_name} TEXT')
+            return table_name
+
+        base_table = "programs_v3"
+        cursor.execute(f'ALTER TABLE {base_table} ADD COLUMN {sql_col_name} TEXT')
+        view_cols = ', '.join(f'"{col}"' for col in existing_cols)
+        drop_relation(cursor, table_name, types=('view',))
+        cursor.execute(
+            f'CREATE VIEW {table_name} AS SELECT {view_cols}, {sql_col_name} FROM {base_table}'
+        )
+        return base_table
+
     def get_servicers(self) -> List[Dict[str, str]]:
         """Get list of available servicers"""
         return [
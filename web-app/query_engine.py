@@ -5,7 +5,6 @@ Direct integration with Python parser - no subprocess spawning.
 
 import sys
 import os
-import json
 import logging
 import sqlite3
 from pathlib import Path
@@ -25,6 +24,8 @@ except ImportError:
     except ImportError:
         from src.parser import QueryParser
 
+from src.query_context import QUERY_CONTEXT
+
 logger = logging.getLogger(__name__)
 
 
@@ -39,19 +40,23 @@ class QueryEngine:
         Initialize the query engine.
 
         Args:
-            db_path: Path to SQLite database (defaults to loanpilot.db in project root)
+            db_path: Path to SQLite database (defaults to loanpilot.db in project root),
+                or a "file:" URI such as an in-memory shared-cache database
             use_llm: Whether to use LLM for query rewriting (default: True)
         """
         # Determine project root
         self.project_root = Path(__file__).parent.parent
         self.db_path = db_path or str(self.project_root / "loanpilot.db")
+        self._db_is_uri = self.db_path.startswith('file:')
 
         # Set scratchpad path to project root before parser initialization
         self.scratchpad_path = str(self.project_root / ".scratchpad_web")
         os.environ['SCRATCHPAD_PATH'] = self.scratchpad_path
+        # When set, execute_query returns this text instead of reading the scratchpad file
+        self._scratchpad_override: Optional[str] = None
 
-        # Verify database exists
-        if not Path(self.db_path).exists():
+        # Verify database exists (URIs may name in-memory databases, so can't be checked)
+        if not self._db_is_uri and not Path(self.db_path).exists():
             logger.error(f"Database not found at {self.db_path}")
             raise FileNotFoundError(f"Database not found: {self.db_path}")
 
@@ -90,8 +95,9 @@ class QueryEngine:
         if context_params:
             logger.info(f"📌 Context params: {context_params}")
 
-        # Set context in environment (for scripts that read it)
-        os.environ['QUERY_CONTEXT'] = json.dumps(context_params)
+        # Expose context to the parser while this query runs; a ContextVar keeps
+        # concurrent queries apart without touching the process environment
+        context_token = QUERY_CONTEXT.set(context_params)
         os.environ['DB_PATH'] = self.db_path
 
         # Use in-memory scratchpad instead of file
@@ -117,9 +123,11 @@ class QueryEngine:
                     # Fallback to old parser
                     success = self.parser.parse_and_execute(normalized_query.replace('^', '').strip())
 
-            # Read results from scratchpad file
+            # Read results from the scratchpad override, else the scratchpad file
             results = ""
-            if Path(self.scratchpad_path).exists():
+            if self._scratchpad_override is not None:
+                results = self._scratchpad_override.strip()
+            elif Path(self.scratchpad_path).exists():
                 with open(self.scratchpad_path, 'r') as f:
                     results = f.read().strip()
 
@@ -155,8 +163,20 @@ class QueryEngine:
                 "executedAt": datetime.utcnow().isoformat()
             }
         finally:
-            # Clean up environment
-            os.environ.pop('QUERY_CONTEXT', None)
+            QUERY_CONTEXT.reset(context_token)
+
+    def set_scratchpad_override(self, text: Optional[str]) -> None:
+        """
+        Serve query results from memory instead of the scratchpad file.
+
+        Args:
+            text: Scratchpad contents to return, or None to read the file again
+        """
+        self._scratchpad_override = text
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection to the configured database path or URI."""
+        return sqlite3.connect(self.db_path, uri=self._db_is_uri)
 
     def get_available_scripts(self) -> List[Dict]:
         """
@@ -166,7 +186,7 @@ class QueryEngine:
             List of dicts with name, description, prompt
         """
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             conn.row_factory = sqlite3.Row  # Enable column access by name
             cursor = conn.cursor()
 
@@ -195,7 +215,7 @@ class QueryEngine:
         """
         try:
             # Check if database is accessible
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             cursor.execute("SELECT COUNT(*) FROM scripts")
             script_count = cursor.fetchone()[0]
@@ -235,7 +255,7 @@ class QueryEngine:
             Dict mapping program names to their details
         """
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
 
@@ -272,7 +292,7 @@ class QueryEngine:
             Parameter value or None
         """
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
 
             cursor.execute(f"""